@@ -0,0 +1,169 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+from car import Car
+from car_batch import CarBatch
+
+
+CONFIGURATIONS = {"I4": ("I", 4), "I6": ("I", 6)}
+
+
+def configuration_args(configuration):
+
+    # parameters.txt with the engine layout replaced
+    all_args = Car.read_parameters("parameters.txt")
+    all_args[0][0], all_args[0][1] = CONFIGURATIONS[configuration]
+    return all_args
+
+
+def warm_car(configuration, dt, warmup=0.05):
+
+    # a car that has been running for a moment so every part has realistic state
+    car = Car(configuration_args(configuration), dt)
+    for _ in range(int(warmup // dt)):
+        car.update()
+    return car
+
+
+def steps_per_second(step, steps):
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    return steps / (time.perf_counter() - start)
+
+
+def component_benchmarks(configuration, dt, steps):
+
+    """
+    Steps per second of each part's update on its own
+    """
+
+    car = warm_car(configuration, dt)
+    cs = car.engine.cs
+    bank = cs.bank
+    cylinder = cs.cylinders[0]
+    tc = car.torque_converter
+    transmission = car.transmission
+
+    return {
+        "car.update": steps_per_second(car.update, steps),
+        "crankshaft.update": steps_per_second(lambda: cs.update(0), steps),
+        "cylinder_bank.update": steps_per_second(lambda: bank.update(bank.current_stroke == 3), steps),
+        "cylinder.update": steps_per_second(lambda: cylinder.update(cylinder.current_stroke == 3), steps),
+        "torque_converter.update": steps_per_second(lambda: tc.update(False, 0), steps),
+        "transmission.update": steps_per_second(lambda: transmission.update(1, car.engine_rpm, car.mph), steps),
+    }
+
+
+def run_benchmarks(durations=(0.1, 0.5), dt=1e-4, batch_size=64, repeat=3):
+
+    """
+    Returns the best of repeat measurements, in steps per second (car-steps per
+    second for the batch), for every benchmark
+    """
+
+    results = {}
+
+    def record(name, value):
+        results[name] = max(results.get(name, 0), value)
+
+    for _ in range(repeat):
+        for configuration in CONFIGURATIONS:
+
+            for name, value in component_benchmarks(configuration, dt, int(durations[0] // dt)).items():
+                record("{}/{}".format(configuration, name), value)
+
+            for duration in durations:
+                steps = int(duration // dt)
+
+                car = Car(configuration_args(configuration), dt)
+                start = time.perf_counter()
+                car.run(duration)
+                record("{}/car.run/{}s".format(configuration, duration), steps / (time.perf_counter() - start))
+
+                batch = CarBatch([configuration_args(configuration)] * batch_size, dt)
+                start = time.perf_counter()
+                batch.run(duration)
+                record("{}/car_batch.run/{}s".format(configuration, duration), steps * batch_size / (time.perf_counter() - start))
+
+    return results
+
+
+def compare(baseline, current, threshold):
+
+    """
+    Returns (name, baseline, current) for every benchmark that got slower by
+    more than threshold (a fraction) relative to baseline, the names of
+    baseline benchmarks with no current result and the names of current
+    benchmarks with no baseline
+    """
+
+    regressions = []
+    for name, before in baseline["results"].items():
+        after = current["results"].get(name)
+        if after is not None and after < before * (1 - threshold):
+            regressions.append((name, before, after))
+    missing = sorted(set(baseline["results"]) - set(current["results"]))
+    added = sorted(set(current["results"]) - set(baseline["results"]))
+    return regressions, missing, added
+
+
+if __name__ == "__main__":
+
+    # run from the repository root: python -m benchmarks.hot_paths run results.json
+    parser = argparse.ArgumentParser(description="Simulation hot path benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and save the results as JSON")
+    run_parser.add_argument("output")
+    run_parser.add_argument("--dt", type=float, default=1e-4)
+    run_parser.add_argument("--durations", type=float, nargs="+", default=[0.1, 0.5])
+    run_parser.add_argument("--batch-size", type=int, default=64)
+    run_parser.add_argument("--repeat", type=int, default=3)
+
+    compare_parser = commands.add_parser("compare", help="fail if current is slower than baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown as a fraction")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = {
+            "meta": {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "dt": args.dt,
+                "batch_size": args.batch_size,
+            },
+            "results": run_benchmarks(args.durations, args.dt, args.batch_size, args.repeat),
+        }
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+        for name, value in results["results"].items():
+            print("{:45} {:>14,.0f} steps/s".format(name, value))
+
+    else:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.current) as file:
+            current = json.load(file)
+
+        regressions, missing, added = compare(baseline, current, args.threshold)
+        for name, before, after in regressions:
+            print("{}: {:,.0f} -> {:,.0f} steps/s ({:.0%})".format(name, before, after, after / before - 1))
+        for name in missing:
+            print("{}: in the baseline but not measured".format(name))
+        for name in added:
+            print("{}: new, no baseline to compare with".format(name))
+
+        # a benchmark that was renamed or broke can't count as no regression
+        if regressions or missing:
+            sys.exit("{} benchmark(s) regressed by more than {:.0%}, {} missing".format(len(regressions), args.threshold, len(missing)))
+        print("no regressions")
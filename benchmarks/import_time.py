@@ -0,0 +1,53 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+CORE_MODULES = ["car", "car_batch", "engine", "crankshaft_cylinder", "torque_converter", "transmission", "wheels", "sweep", "torque_map"]
+
+# libraries the physics must not pull in on import
+HEAVY_MODULES = ["matplotlib", "pygame"]
+
+CHECK = """
+import sys, time
+start = time.perf_counter()
+import {modules}
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(",".join(name for name in {heavy} if name in sys.modules))
+"""
+
+
+def measure(modules=CORE_MODULES, repeat=5):
+
+    """
+    Imports modules in fresh interpreters and returns the median cold import
+    time (seconds) and any heavy libraries that were loaded along the way
+    """
+
+    code = CHECK.format(modules=", ".join(modules), heavy=HEAVY_MODULES)
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split("\n")
+        times.append(float(output[0]))
+        loaded = [name for name in output[1].split(",") if name]
+    return statistics.median(times), loaded
+
+
+if __name__ == "__main__":
+
+    # run from the repository root: python -m benchmarks.import_time
+    parser = argparse.ArgumentParser(description="Check the cold import time of the physics core")
+    parser.add_argument("--budget", type=float, default=0.5, help="maximum median import time in seconds")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    elapsed, loaded = measure(repeat=args.repeat)
+    print(json.dumps({"import_seconds": elapsed, "budget_seconds": args.budget, "heavy_modules_loaded": loaded}))
+
+    if loaded:
+        sys.exit("physics core imported {}".format(", ".join(loaded)))
+    if elapsed > args.budget:
+        sys.exit("import took {:.3f} s, over the {:.3f} s budget".format(elapsed, args.budget))
@@ -0,0 +1,66 @@
+import argparse
+import gc
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.hot_paths import CONFIGURATIONS, configuration_args
+from car import Car
+from car_batch import CarBatch
+
+
+def traced_bytes(build):
+
+    """
+    Memory (bytes) still allocated after build() returns, as tracemalloc sees
+    it, and what build() returned
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, built
+
+
+def bytes_per_car(num_cars=1000, dt=1e-4):
+
+    """
+    Bytes per car of num_cars separate Car objects and of a CarBatch holding
+    num_cars cars in double and single precision, for every configuration.
+    Batch sizes count the arrays themselves (nbytes) as well as everything
+    the batch keeps alive
+    """
+
+    results = {}
+    for configuration in CONFIGURATIONS:
+        all_args = configuration_args(configuration)
+        Car(all_args, dt) # imports and one-off caches don't count
+
+        total, cars = traced_bytes(lambda: [Car(all_args, dt) for _ in range(num_cars)])
+        results["{}/car".format(configuration)] = total / num_cars
+        del cars
+
+        for dtype in (np.float64, np.float32):
+            total, batch = traced_bytes(lambda: CarBatch([all_args] * num_cars, dt, dtype))
+            name = "{}/car_batch/{}".format(configuration, np.dtype(dtype).name)
+            results[name] = total / num_cars
+            results[name + "/arrays"] = batch.nbytes() / num_cars
+            del batch
+
+    return results
+
+
+if __name__ == "__main__":
+
+    # run from the repository root: python -m benchmarks.memory
+    parser = argparse.ArgumentParser(description="Memory used per simulated car")
+    parser.add_argument("--cars", type=int, default=1000)
+    parser.add_argument("--dt", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    for name, value in bytes_per_car(args.cars, args.dt).items():
+        print("{:35} {:>10,.0f} bytes/car".format(name, value))
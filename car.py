@@ -1,69 +1,110 @@
 import math
+import pickle
 import time
-import matplotlib.pyplot as plt
 import numpy as np
-import pygame
 import sys
-import ast
 
+from config import load_vehicle
 from engine import Engine
 from torque_converter import TorqueConverter
 from transmission import Transmission
 from wheels import Wheels
+from renderer import EngineRenderer
+
+
+# telemetry recorded by Car.run(); maps each field to its dtype
+TELEMETRY_FIELDS = {
+    "time": float,
+    "engine_rpm": float,
+    "mph": float,
+    "gear": int,
+    "torque": float,
+    "hp": float,
+    "turbine_omega": float,
+}
+
+# how to read each field Car.stream() can record
+FIELD_GETTERS = {
+    "time": lambda car: car.time,
+    "engine_rpm": lambda car: car.engine_rpm,
+    "mph": lambda car: car.mph,
+    "gear": lambda car: car.transmission.current_gear,
+    "torque": lambda car: car.engine.torque,
+    "hp": lambda car: car.engine.hp,
+    "turbine_omega": lambda car: car.torque_converter.turbine_omega,
+    "throttle": lambda car: car.throttle,
+    "crank_omega": lambda car: car.engine.cs.omega,
+    "wheel_omega": lambda car: car.wheels.omega,
+    "linear_speed": lambda car: car.wheels.linear_speed,
+    "drag": lambda car: car.wheels.drag,
+    "shifting": lambda car: car.transmission.shifting,
+    "fuel_used": lambda car: car.engine.cs.bank.fuel_used,
+}
+
+# run_until() tracks these values, interpolated at crossings; distance (m) counts from the start of the run
+CROSSING_FIELDS = ["time", "mph", "engine_rpm", "distance"]
+
+QUARTER_MILE = 402.336 # m
+
+
+def state_of(obj, skip=()):
+
+    # an object's attributes minus the skipped ones and any methods a Profiler attached
+    return {name: value for name, value in vars(obj).items() if name not in skip and not callable(value)}
 
 
 class Car:
     
-    def __init__(self) -> None:
+    def __init__(self, all_args=None, dt=None, substeps=1, max_crank_step=math.pi / 18, torque_map=None, interpolate_events=False, cycle_cache=False) -> None:
 
-        self.TIME_STEP = 1
+        # a fixed dt makes the car deterministic and skips calibrate_time()'s wall-clock measurement
+        self.dt = dt
+        self.TIME_STEP = 1 if dt is None else dt
+
+        # the crankshaft and cylinders take substeps smaller steps per car step; with
+        # substeps="auto" enough are taken to keep each under max_crank_step radians
+        self.substeps = substeps
+        self.max_crank_step = max_crank_step
+
+        # a TorqueMap replaces the crankshaft and cylinder model with a mean torque lookup
+        self.torque_map = torque_map
+
+        # fire spark, injection and exhaust at the interpolated crossing instead of a step late
+        self.interpolate_events = interpolate_events
+
+        # simulate one cylinder and phase-shift its force curve for the rest (see Crankshaft.use_cycle_cache)
+        self.cycle_cache = cycle_cache
+
+        # set by enable_profiling(); None means no instrumentation at all
+        self.profiler = None
         self.engine_rpm = 0
         self.mph = 0
 
-        self.all_args = self.read_parameters("parameters.txt")
+        # all_args holds the four argument lists read_parameters() produces
+        if all_args is None:
+            all_args = self.read_parameters("parameters.txt")
+        self.all_args = all_args
         self.initialize()
 
     
     # read parameters from parameters.txt and put all the properly typed data into arrays
-    def read_parameters(self, file_name):
-
-        default_engine_args = ["I", 6, 0.08, 0.0896, 9.3, 1.4, 5500]
-        default_tc_args = [2, 0.03, 0.005, 0.05]
-        default_transmission_args = [6, [3.2, 2.6, 1.8, 1.3, 1, 0.8], 0.3]
-        default_wheel_args = [3.15, 0.33, 2, 175927, 0.24]
-        default_list = [default_engine_args, default_tc_args, default_transmission_args, default_wheel_args]
-
-        engine_args = []
-        torque_converter_args = []
-        transmission_args = []
-        wheel_args = []
-        
-        arg_lists = [engine_args, torque_converter_args, transmission_args, wheel_args]
-        
-        with open(file_name, 'r') as file:
-            current_list = 0
-            counter = 0
-            for line in file:
-                line = line.strip()
-                if line:
-                    if line[0] == '#':
-                        continue
-                    elif line[0] == '*':
-                        counter = 0
-                        current_list += 1
-                    else:
-                        try:
-                            data = ast.literal_eval(line.split("=")[-1]) # split at equals sign, choose type using ast
-                            arg_lists[current_list].append(data)
-                        except:
-                            arg_lists[current_list].append(default_list[current_list][counter]) # if field is left blank, use default value
-                        counter += 1
-
-        return arg_lists
+    @staticmethod
+    def read_parameters(file_name):
+
+        """
+        Returns the engine, torque converter, transmission and wheel argument
+        lists for the (first) vehicle in file_name; blank fields use default
+        values and malformed ones raise config.ConfigError
+        """
+
+        return load_vehicle(file_name).all_args()
 
     
     def calibrate_time(self, override=0):
-        
+
+        if override <= 0 and self.dt is not None:
+            override = self.dt
+
         if override <= 0:
             start = time.time()
             print("Calibrating...")
@@ -77,14 +118,24 @@ class Car:
             override = (end - start) / 1000
         
         self.initialize()
-        
-        self.TIME_STEP = override
-        self.engine.cs.set_cylinder_time_step(self.TIME_STEP)
-        self.engine.cs.TIME_STEP = self.TIME_STEP
-        self.torque_converter.TIME_STEP = self.TIME_STEP
-        self.transmission.TIME_STEP = self.TIME_STEP
-        self.wheels.TIME_STEP = self.TIME_STEP
-        
+        self.set_time_step(override)
+
+
+    # sets TIME_STEP for every part in one place
+    def set_time_step(self, dt):
+
+        self.TIME_STEP = dt
+        engine_dt = dt if self.substeps == "auto" else dt / self.substeps
+        self.engine.cs.set_cylinder_time_step(engine_dt)
+        self.engine.cs.TIME_STEP = engine_dt
+        self.torque_converter.TIME_STEP = dt
+        self.transmission.TIME_STEP = dt
+        self.wheels.TIME_STEP = dt
+
+        # the shift delay counts steps, so its length depends on the time step
+        if not self.transmission.shifting:
+            self.transmission.shift_delay = self.transmission.shift_delay_gen()
+
 
     # sets all parameters
     def initialize(self):
@@ -95,6 +146,12 @@ class Car:
         self.transmission = Transmission(*self.all_args[2])
         self.wheels = Wheels(*self.all_args[3])
         
+        self.engine.torque_map = self.torque_map
+        self.engine.cs.interpolate_events = self.interpolate_events
+        if self.cycle_cache:
+            self.engine.cs.use_cycle_cache()
+        self.time = 0
+
         # starting engine
         self.engine.cs.omega = 50
 
@@ -102,16 +159,58 @@ class Car:
         self.engine.cs.moment += self.torque_converter.impeller_and_fluid_moment
         self.torque_converter.driveshaft_moment += self.transmission.moment + (self.wheels.moment / self.transmission.gear_ratio / self.wheels.final_drive_ratio)
 
-    def update(self):
+        if self.dt is not None:
+            self.set_time_step(self.dt)
+
+        # the parts were just rebuilt, so instrument the new ones
+        if self.profiler is not None:
+            self.profiler.attach(self)
 
-        self.throttle = 1
+    def use_torque_map(self, cache_dir="torque_maps"):
+
+        """
+        Switches the car to map-driven mode using this engine's TorqueMap,
+        characterizing the engine only if its map is not already cached
+        """
+
+        from torque_map import cached_torque_map
+
+        self.torque_map = cached_torque_map(self.all_args[0], cache_dir)
+        self.engine.torque_map = self.torque_map
+        self.time = 0
+
+
+    def enable_profiling(self):
+
+        """
+        Starts recording per-subsystem time, call counts and event counts in a
+        Profiler, which is returned; disable_profiling() removes it again
+        """
+
+        from profiler import Profiler
+
+        self.profiler = Profiler()
+        self.profiler.attach(self)
+        return self.profiler
+
+
+    def disable_profiling(self):
+        if self.profiler is not None:
+            self.profiler.detach()
+        self.profiler = None
+
+
+    def update(self, throttle=1):
+
+        self.throttle = throttle
+        self.time += self.TIME_STEP
         
         # when shift is complete
         prev_gear_ratio = self.transmission.gear_ratio
         
         # set omega and torque of impeller equal to omega and torque of engine
         self.torque_converter.impeller_omega = self.engine.cs.omega
-        self.torque_converter.input_torque = self.engine.cs.torque
+        self.torque_converter.input_torque = self.engine.torque
 
         # set omega of transmission equal to omega of turbine
         self.transmission.input_omega = self.torque_converter.turbine_omega 
@@ -124,7 +223,7 @@ class Car:
         drag_loss = (self.wheels.drag * self.wheels.radius / (self.transmission.gear_ratio * self.wheels.final_drive_ratio))
 
         # update every part
-        self.engine.update(self.throttle, drag_loss)
+        self.update_engine(drag_loss)
         self.torque_converter.update(self.transmission.shifting, drag_loss)
         self.transmission.update(self.throttle, self.engine_rpm, self.mph)
         self.wheels.update()
@@ -135,76 +234,345 @@ class Car:
 
         # use wheel speed to set the rotational speed of other parts (updating in opposite direction)
         if self.transmission.just_shifted:
-                    
-            self.transmission.output_omega = self.wheels.omega * self.wheels.final_drive_ratio
+            self.finish_shift(prev_gear_ratio)
 
-            self.torque_converter.turbine_omega = self.transmission.output_omega * self.transmission.gear_ratio
-            self.torque_converter.driveshaft_moment = 0.3 + self.transmission.moment + (self.wheels.moment / self.transmission.gear_ratio / self.wheels.final_drive_ratio)
 
-            self.engine.cs.omega *= self.transmission.gear_ratio / prev_gear_ratio
-            self.engine.cs.moment += prev_gear_ratio / self.transmission.gear_ratio 
-        
-            # shifting process done; wait for next shift
-            self.transmission.just_shifted = False
+    def finish_shift(self, prev_gear_ratio):
 
+        self.transmission.output_omega = self.wheels.omega * self.wheels.final_drive_ratio
 
-    def demo_run(self, duration, override=0, animate=False):
-        
-        self.calibrate_time(override)
-        steps = int(duration // self.TIME_STEP)
+        self.torque_converter.turbine_omega = self.transmission.output_omega * self.transmission.gear_ratio
+        self.torque_converter.driveshaft_moment = 0.3 + self.transmission.moment + (self.wheels.moment / self.transmission.gear_ratio / self.wheels.final_drive_ratio)
 
-        if animate:
-            # pygame setup
-            pygame.init()
-            screen = pygame.display.set_mode((1000, 720))
-            pixel_stroke = 200 / self.engine.cs.cylinders[0].stroke
-            pixel_x_list = np.linspace(200, 800, self.engine.num_cylinders)
-    
-        for _ in range(steps):
-            
-            self.update()
-            print("RPM: {}\nSPEED: {}\nGEAR: {}\nTIME: {}\n".format(self.engine_rpm, self.mph, self.transmission.current_gear, _ * self.TIME_STEP))
-            
-            # PYGAME ANIMATION #######################
-            
-            if animate:
-                # poll for events
-                # pygame.QUIT event means the user clicked X to close your window
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        sys.exit()
-
-                # fill the screen with a color to wipe away anything from last frame
-                screen.fill("black")
-
-                for x, cyl in zip(pixel_x_list, self.engine.cs.cylinders):
-                    color = "blue"
-                    if cyl.current_stroke == 3:
-                        color = "red"
-                    pygame.draw.circle(screen, color, [x, 720 - (250 + pixel_stroke * cyl.x)], 40)
-
-                # flip() the display to put your work on screen
-                pygame.display.flip()
-                
-        plt.show()
+        self.engine.cs.omega *= self.transmission.gear_ratio / prev_gear_ratio
+        self.engine.cs.moment += prev_gear_ratio / self.transmission.gear_ratio 
     
-        pygame.quit()
+        # shifting process done; wait for next shift
+        self.transmission.just_shifted = False
 
 
+    def update_engine(self, drag_loss):
 
+        """
+        Advances the engine by one car step. With more than one substep the
+        crankshaft and cylinders take several smaller steps, and the torque
+        handed to the torque converter is their average
+        """
 
+        substeps = self.substeps
+        if substeps == "auto":
+            substeps = max(1, math.ceil(abs(self.engine.cs.omega) * self.TIME_STEP / self.max_crank_step))
+            self.engine.cs.TIME_STEP = self.TIME_STEP / substeps
 
+        if substeps == 1:
+            self.engine.update(self.throttle, drag_loss)
+            return
 
-        
-       
+        torque = 0
+        for _ in range(substeps):
+            self.engine.update(self.throttle, drag_loss)
+            torque += self.engine.torque
 
+        self.engine.torque = torque / substeps
+        self.engine.hp = self.engine.torque * self.engine.cs.omega / 745.7
 
 
+    def start_run(self, dt, reset):
 
-    
+        """
+        Shared setup for run() and stream(): with reset the car starts over at a
+        time step of dt (the car's own dt by default), otherwise it carries on
+        from its current state (and time step, unless dt is given)
+        """
 
-        
+        if dt is None:
+            dt = self.dt if reset else self.TIME_STEP
+        if dt is None or dt <= 0:
+            raise ValueError("dt must be positive")
+
+        if reset:
+            self.calibrate_time(dt)
+        elif dt != self.TIME_STEP:
+            self.set_time_step(dt)
+
+        return dt
+
+
+    def run(self, duration, dt=None, throttle=1, reset=True):
+
+        """
+        Runs the simulation for duration seconds at a fixed time step of dt (the
+        car's own dt by default) without printing or drawing anything; throttle is
+        either a constant or an array with one value per step. Returns a dict of
+        NumPy arrays keyed by TELEMETRY_FIELDS. With reset=False the run carries
+        on from the car's current state, e.g. after restore()
+        """
+
+        dt = self.start_run(dt, reset)
+        steps = int(duration // dt)
+
+        throttle = np.broadcast_to(np.asarray(throttle, dtype=float), (steps,)).tolist()
+        telemetry = {field: np.empty(steps, dtype=dtype) for field, dtype in TELEMETRY_FIELDS.items()}
+        telemetry["time"][:] = self.time + np.arange(1, steps + 1) * dt
+
+        # local names avoid repeated dict and attribute lookups in the loop
+        engine_rpm = telemetry["engine_rpm"]
+        mph = telemetry["mph"]
+        gear = telemetry["gear"]
+        torque = telemetry["torque"]
+        hp = telemetry["hp"]
+        turbine_omega = telemetry["turbine_omega"]
+
+        for i in range(steps):
+
+            self.update(throttle[i])
+
+            engine_rpm[i] = self.engine_rpm
+            mph[i] = self.mph
+            gear[i] = self.transmission.current_gear
+            torque[i] = self.engine.torque
+            hp[i] = self.engine.hp
+            turbine_omega[i] = self.torque_converter.turbine_omega
+
+        return telemetry
+
+
+    def stream(self, duration, every=1, fields=None, dt=None, throttle=1, chunk_size=None, reset=True):
+
+        """
+        Generator version of run() for long runs. Every `every` steps it yields a
+        dict of the requested FIELD_GETTERS fields (all of TELEMETRY_FIELDS by
+        default), or with chunk_size, a dict of arrays holding chunk_size such
+        records. Only the requested fields are read and nothing is kept between
+        chunks, so memory stays constant. throttle is a constant or a function of
+        the simulation time, and reset works as in run()
+        """
+
+        fields = list(TELEMETRY_FIELDS) if fields is None else list(fields)
+        for field in fields:
+            if field not in FIELD_GETTERS:
+                raise ValueError("unknown field: {}".format(field))
+        getters = [FIELD_GETTERS[field] for field in fields]
+
+        dt = self.start_run(dt, reset)
+        steps = int(duration // dt)
+        throttle_at = throttle if callable(throttle) else (lambda t: throttle)
+
+        rows = []
+        for i in range(1, steps + 1):
+
+            self.update(throttle_at(self.time))
+
+            if i % every:
+                continue
+
+            if chunk_size is None:
+                yield {field: get(self) for field, get in zip(fields, getters)}
+                continue
+
+            rows.append([get(self) for get in getters])
+            if len(rows) == chunk_size or i + every > steps:
+                yield {field: np.array(column) for field, column in zip(fields, zip(*rows))}
+                rows = []
+
+
+    def run_until(self, mph=None, distance=None, rpm=None, gear=None, max_time=60, dt=None, throttle=1, marks=None, stop_after_marks=False, reset=True):
+
+        """
+        Runs until the first stop condition is met: mph or rpm reaching a value,
+        distance (m, integrated from the wheels' linear speed) covered, a gear
+        reached, or max_time seconds passed. marks maps names to (field, value)
+        thresholds in mph, engine_rpm or distance that are recorded on the way
+        without stopping, unless stop_after_marks is set and all of them are
+        reached. Crossings are interpolated between the two steps around them.
+        Returns a dict with what stopped the run ("stop"), the CROSSING_FIELDS
+        and gear at that moment, and for every mark the CROSSING_FIELDS at its
+        crossing (None if it was never reached); times count from the start of
+        this run, and the car itself is left at the end of the last step
+        """
+
+        dt = self.start_run(dt, reset)
+        throttle_at = throttle if callable(throttle) else (lambda t: throttle)
+        start_time = self.time
+        distance_covered = 0
+
+        limits = [(name, field, value) for name, field, value in (("mph", "mph", mph), ("distance", "distance", distance), ("rpm", "engine_rpm", rpm)) if value is not None]
+        pending = [(name, field, value) for name, (field, value) in (marks or {}).items()]
+        for name, field, value in pending:
+            if field not in CROSSING_FIELDS[1:]:
+                raise ValueError("can't mark {}: unknown field {}".format(name, field))
+        reached = {name: None for name, field, value in pending}
+
+        previous = {"time": 0.0, "mph": self.mph, "engine_rpm": self.engine_rpm, "distance": 0.0}
+
+        def crossing(current, fraction):
+            point = {field: previous[field] + (current[field] - previous[field]) * fraction for field in CROSSING_FIELDS}
+            point["gear"] = self.transmission.current_gear
+            return point
+
+        def fraction_to(current, field, value):
+            # how far into the step value was crossed, or None if it wasn't
+            if current[field] < value:
+                return None
+            if previous[field] >= value or current[field] == previous[field]:
+                return 0.0 if previous[field] >= value else 1.0
+            return (value - previous[field]) / (current[field] - previous[field])
+
+        # conditions already met at the start of the run
+        stop = None
+        for name, field, value in limits:
+            if previous[field] >= value:
+                stop = (name, 0.0)
+
+        current = previous
+        steps = 0 if stop is not None else int(max_time // dt)
+        for _ in range(steps):
+
+            self.update(throttle_at(self.time))
+            distance_covered += self.wheels.linear_speed * dt
+            current = {"time": self.time - start_time, "mph": self.mph, "engine_rpm": self.engine_rpm, "distance": distance_covered}
+
+            candidates = []
+            for name, field, value in pending:
+                fraction = fraction_to(current, field, value)
+                if fraction is not None:
+                    reached[name] = crossing(current, fraction)
+                    candidates.append((fraction, "marks"))
+            if pending and len(candidates) == len(pending) and stop_after_marks:
+                # stop at the last mark's crossing
+                candidates = [max(candidates)]
+            else:
+                candidates = []
+            pending = [mark for mark in pending if reached[mark[0]] is None]
+
+            for name, field, value in limits:
+                fraction = fraction_to(current, field, value)
+                if fraction is not None:
+                    candidates.append((fraction, name))
+            if gear is not None and self.transmission.current_gear >= gear:
+                candidates.append((1.0, "gear"))
+            if candidates:
+                fraction, name = min(candidates)
+                stop = (name, fraction)
+                break
+
+            previous = current
+
+        if stop is None:
+            stop = ("max_time", 1.0)
+
+        result = crossing(current, stop[1])
+        result["stop"] = stop[0]
+        result["marks"] = reached
+        return result
+
+
+    def performance_metrics(self, dt=None, max_time=60, throttle=1):
+
+        """
+        Standard acceleration metrics from a standing start, measured with
+        run_until(): 0-60 and 0-100 mph times and the quarter mile's elapsed
+        time and trap speed. The run stops as soon as all of them are known;
+        metrics not reached within max_time are NaN
+        """
+
+        result = self.run_until(max_time=max_time, dt=dt, throttle=throttle, stop_after_marks=True, marks={
+            "zero_to_sixty": ("mph", 60),
+            "zero_to_hundred": ("mph", 100),
+            "quarter_mile": ("distance", QUARTER_MILE),
+        })
+        marks = result["marks"]
+        missing = {"time": np.nan, "mph": np.nan}
+        return {
+            "zero_to_sixty": float((marks["zero_to_sixty"] or missing)["time"]),
+            "zero_to_hundred": float((marks["zero_to_hundred"] or missing)["time"]),
+            "quarter_mile_time": float((marks["quarter_mile"] or missing)["time"]),
+            "quarter_mile_mph": float((marks["quarter_mile"] or missing)["mph"]),
+            "simulated_seconds": float(result["time"]),
+        }
+
+
+    def snapshot(self):
+
+        """
+        Returns the complete simulation state as compact bytes (a pickle), which
+        restore() or Car.from_snapshot() turn back into a car that continues
+        exactly as this one would; a snapshot can be restored any number of
+        times, in this or another process
+        """
+
+        cs = self.engine.cs
+        state = {
+            "car": state_of(self, skip=("engine", "torque_converter", "transmission", "wheels", "profiler")),
+            "engine": state_of(self.engine, skip=("cs",)),
+            "crankshaft": state_of(cs, skip=("cylinders", "bank")),
+            "cylinders": state_of(cs.bank),
+            "cylinder_time_step": cs.cylinders[0].TIME_STEP,
+            "torque_converter": state_of(self.torque_converter),
+            "transmission": state_of(self.transmission, skip=("shift_delay",)),
+            "wheels": state_of(self.wheels),
+        }
+        return pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+
+
+    def restore(self, snapshot):
+
+        """
+        Puts the car back into the state captured by snapshot()
+        """
+
+        state = pickle.loads(snapshot)
+
+        # rebuild the parts for the snapshot's config (and time step), then overwrite their state
+        self.__dict__.update(state["car"])
+        self.initialize()
+        self.__dict__.update(state["car"])
+
+        cs = self.engine.cs
+        self.engine.__dict__.update(state["engine"])
+        cs.__dict__.update(state["crankshaft"])
+        cs.bank.__dict__.update(state["cylinders"])
+        cs.set_cylinder_time_step(state["cylinder_time_step"])
+        self.torque_converter.__dict__.update(state["torque_converter"])
+        self.transmission.__dict__.update(state["transmission"])
+        self.wheels.__dict__.update(state["wheels"])
+
+        # resume the shift delay where it was
+        self.transmission.shift_delay = self.transmission.shift_delay_gen(self.transmission.shift_delay_step)
 
 
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        car = cls.__new__(cls)
+        car.profiler = None
+        car.restore(snapshot)
+        return car
 
 
+    def demo_run(self, duration, override=0, animate=False, fps=60, headless=False):
+        
+        self.calibrate_time(override)
+        steps = int(duration // self.TIME_STEP)
+
+        # the renderer draws at a fixed frame rate, so physics steps between frames run at full speed
+        if animate:
+            renderer = EngineRenderer(self.engine, fps, headless)
+    
+        for _ in range(steps):
+            
+            self.update()
+            print("RPM: {}\nSPEED: {}\nGEAR: {}\nTIME: {}\n".format(self.engine_rpm, self.mph, self.transmission.current_gear, _ * self.TIME_STEP))
+            
+            # PYGAME ANIMATION #######################
+            
+            if animate:
+                renderer.render(self.engine)
+                if renderer.closed:
+                    sys.exit()
+                
+        # matplotlib is only loaded here so the physics can be imported without it
+        import matplotlib.pyplot as plt
+        plt.show()
+
+        if animate:
+            renderer.close()
@@ -0,0 +1,265 @@
+import ast
+import dataclasses
+import hashlib
+import os
+import pickle
+import tempfile
+
+from crankshaft_cylinder import LAYOUTS
+
+
+class ConfigError(ValueError):
+    pass
+
+
+@dataclasses.dataclass(frozen=True)
+class EngineConfig:
+    configuration: str = "I"
+    num_cylinders: int = 6
+    stroke: float = 0.08
+    bore: float = 0.0896
+    compression_ratio: float = 9.3
+    volumetric_efficiency: float = 1.4
+    peak_rpm: float = 5500
+
+
+@dataclasses.dataclass(frozen=True)
+class TorqueConverterConfig:
+    k: float = 2
+    c: float = 0.03
+    a: float = 0.005
+    viscosity: float = 0.05
+
+
+@dataclasses.dataclass(frozen=True)
+class TransmissionConfig:
+    number_of_gears: int = 6
+    ratio_list: tuple = (3.2, 2.6, 1.8, 1.3, 1, 0.8)
+    shift_time: float = 0.3
+    shift_map: str = "" # shift map file, relative to the parameters file; blank for the built-in schedule
+
+
+@dataclasses.dataclass(frozen=True)
+class WheelsConfig:
+    final_drive_ratio: float = 3.15
+    drag_coef: float = 0.33
+    cross_sectional_area: float = 2
+    mass_per_wheel: float = 175927
+    radius: float = 0.24
+
+
+SECTIONS = [EngineConfig, TorqueConverterConfig, TransmissionConfig, WheelsConfig]
+SECTION_FIELDS = [dataclasses.fields(section) for section in SECTIONS]
+
+# bump when the parsed structure changes so old caches are ignored
+CACHE_VERSION = 2
+
+
+@dataclasses.dataclass(frozen=True)
+class VehicleConfig:
+
+    name: str
+    engine: EngineConfig
+    torque_converter: TorqueConverterConfig
+    transmission: TransmissionConfig
+    wheels: WheelsConfig
+
+    def all_args(self):
+
+        # the four argument lists Car expects, in constructor order
+        return [
+            [list(value) if isinstance(value, tuple) else value for value in dataclasses.astuple(section)]
+            for section in (self.engine, self.torque_converter, self.transmission, self.wheels)
+        ]
+
+
+def parse_value(text):
+
+    """
+    Turns the (stripped) text after the equals sign into a Python value; numbers,
+    quoted strings and flat lists are handled directly, anything else by ast
+    """
+
+    if text.lstrip("+-").isdigit():
+        return int(text)
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "\"'":
+        return text[1:-1]
+    if text[:1] == "[" and text[-1:] == "]" and "[" not in text[1:]:
+        return [parse_value(item.strip()) for item in text[1:-1].split(",") if item.strip()]
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        raise ValueError("can't read {!r}".format(text)) from None
+
+
+def check_field(field, value):
+
+    # converts value to the field's type and checks that it makes sense
+    if field.type is str:
+        if not isinstance(value, str):
+            raise ValueError("expected a string")
+        return value
+
+    if field.type is tuple:
+        if not isinstance(value, (list, tuple)) or not value:
+            raise ValueError("expected a non-empty list")
+        if not all(isinstance(item, (int, float)) and item > 0 for item in value):
+            raise ValueError("expected a list of positive numbers")
+        return tuple(value)
+
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("expected a number")
+    if field.type is int and not isinstance(value, int):
+        raise ValueError("expected a whole number")
+    if value <= 0:
+        raise ValueError("expected a positive number")
+    if field.name == "compression_ratio" and value <= 1:
+        raise ValueError("compression ratio must be greater than 1")
+    return value
+
+
+def build_vehicle(name, sections, location):
+
+    """
+    Builds a VehicleConfig from four lists of (line number, stripped text) value
+    entries; blank values use the field's default
+    """
+
+    built = []
+    for section, fields, entries in zip(SECTIONS, SECTION_FIELDS, sections):
+        if len(entries) > len(fields):
+            line_number = entries[len(fields)][0]
+            raise ConfigError("{}:{}: {} section has only {} fields".format(location, line_number, section.__name__, len(fields)))
+
+        values = {}
+        for field, (line_number, text) in zip(fields, entries):
+            if not text:
+                continue
+            try:
+                values[field.name] = check_field(field, parse_value(text))
+            except ValueError as error:
+                raise ConfigError("{}:{}: {}: {}".format(location, line_number, field.name, error)) from None
+        built.append(section(**values))
+
+    engine, torque_converter, transmission, wheels = built
+    if (engine.configuration, engine.num_cylinders) not in LAYOUTS:
+        raise ConfigError("{}: vehicle {}: no {}{} engine layout".format(location, name, engine.configuration, engine.num_cylinders))
+    if len(transmission.ratio_list) != transmission.number_of_gears:
+        raise ConfigError("{}: vehicle {}: {} gear ratios for {} gears".format(location, name, len(transmission.ratio_list), transmission.number_of_gears))
+    if transmission.shift_map:
+        shift_map = os.path.join(os.path.dirname(location), transmission.shift_map)
+        if not os.path.isfile(shift_map):
+            raise ConfigError("{}: vehicle {}: no shift map file {}".format(location, name, shift_map))
+        transmission = dataclasses.replace(transmission, shift_map=shift_map)
+
+    return VehicleConfig(name, engine, torque_converter, transmission, wheels)
+
+
+def parse_catalog(lines, location, default_name):
+
+    """
+    Parses the parameters.txt format. A catalog holds several vehicles, each
+    starting with a [name] line; a file without any is a single vehicle. Within
+    a vehicle, lines of * separate the engine, torque converter, transmission
+    and wheels sections, and each section lists its fields in order
+    """
+
+    vehicles = []
+    names = set()
+    name = default_name
+    sections = [[]]
+
+    def finish():
+        if len(sections) > len(SECTIONS):
+            raise ConfigError("{}: vehicle {} has more than {} sections".format(location, name, len(SECTIONS)))
+        if name in names:
+            raise ConfigError("{}: duplicate vehicle name {}".format(location, name))
+        names.add(name)
+        vehicles.append(build_vehicle(name, sections + [[]] * (len(SECTIONS) - len(sections)), location))
+
+    started = False
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        if line[0] == '[' and line[-1] == ']':
+            if started:
+                finish()
+            name = line[1:-1].strip()
+            sections = [[]]
+            started = True
+        elif line[0] == '*':
+            sections.append([])
+        else:
+            sections[-1].append((line_number, line.split("=")[-1].strip())) # split at equals sign
+            started = True
+
+    if started:
+        finish()
+    return vehicles
+
+
+def load_catalog(file_name, cache=True):
+
+    """
+    Returns the list of VehicleConfigs in file_name. With cache=True the parsed
+    result is stored next to the file in a binary .cache file, reused while the
+    file's modification time and size (or, failing that, its contents' hash)
+    are unchanged
+    """
+
+    cache_name = file_name + ".cache"
+    stat = os.stat(file_name)
+    stamp = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+
+    cached = None
+    if cache:
+        try:
+            with open(cache_name, "rb") as file:
+                cached = pickle.load(file)
+            if cached["stamp"] == stamp:
+                return cached["vehicles"]
+        except (OSError, pickle.PickleError, EOFError, KeyError, TypeError):
+            cached = None
+
+    with open(file_name, "rb") as file:
+        contents = file.read()
+    digest = hashlib.sha1(contents).hexdigest()
+
+    # touched but unchanged files don't need parsing again
+    if cached is not None and cached.get("version") == CACHE_VERSION and cached.get("digest") == digest:
+        vehicles = cached["vehicles"]
+    else:
+        default_name = os.path.splitext(os.path.basename(file_name))[0]
+        vehicles = parse_catalog(contents.decode().splitlines(), file_name, default_name)
+
+    if cache:
+        # a temporary file of its own, so processes loading the catalog at once never mix their writes
+        descriptor, temporary = tempfile.mkstemp(".tmp", dir=os.path.dirname(os.path.abspath(cache_name)))
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                pickle.dump({"stamp": stamp, "version": CACHE_VERSION, "digest": digest, "vehicles": vehicles}, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, cache_name)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    return vehicles
+
+
+def load_vehicle(file_name, name=None, cache=False):
+
+    # a single vehicle from file_name; the first one unless a name is given
+    vehicles = load_catalog(file_name, cache)
+    if name is None:
+        if not vehicles:
+            raise ConfigError("{}: no vehicles".format(file_name))
+        return vehicles[0]
+    for vehicle in vehicles:
+        if vehicle.name == name:
+            return vehicle
+    raise ConfigError("{}: no vehicle named {}".format(file_name, name))
@@ -1,29 +1,181 @@
-import sys
+import heapq
+
 import numpy as np
-import matplotlib.pyplot as plt
-import time
 from math import pi, floor
 
 
 R = 8.3145
 ENGINE_TEMP = 20 + 273.15 # K
 
+# radians; stroke events this close to due are checked against the real angles
+EVENT_MARGIN = 1e-3
 
-class Cylinder:
+# force table bins per four-stroke cycle for Crankshaft.use_cycle_cache()
+CYCLE_BINS = 720
+
+
+# firing order, crank pin angles and bank of every cylinder (numbered from 1), and the
+# angle between the banks. Pin angles are in degrees behind the first pin, and the
+# second bank sits bank_angle degrees behind the first, so a cylinder reaches top dead
+# center once the crank has turned its pin angle plus its bank's angle
+LAYOUTS = {
+    ("I", 3): {"firing_order": [1, 2, 3], "pins": [0, 240, 120], "banks": [0, 0, 0], "bank_angle": 0},
+    ("I", 4): {"firing_order": [1, 3, 4, 2], "pins": [0, 180, 180, 0], "banks": [0, 0, 0, 0], "bank_angle": 0},
+    ("I", 5): {"firing_order": [1, 2, 4, 5, 3], "pins": [0, 144, 216, 288, 72], "banks": [0, 0, 0, 0, 0], "bank_angle": 0},
+    ("I", 6): {"firing_order": [1, 5, 3, 6, 2, 4], "pins": [0, 120, 240, 240, 120, 0], "banks": [0, 0, 0, 0, 0, 0], "bank_angle": 0},
+    ("V", 6): {"firing_order": [1, 2, 3, 4, 5, 6], "pins": [0, 60, 240, 300, 120, 180], "banks": [0, 1, 0, 1, 0, 1], "bank_angle": 60}, # split pins
+    ("V", 8): {"firing_order": [1, 8, 4, 3, 6, 5, 7, 2], "pins": [0, 0, 270, 270, 90, 90, 180, 180], "banks": [1, 0, 1, 0, 1, 0, 1, 0], "bank_angle": 90}, # cross-plane
+    ("V", 12): {"firing_order": [1, 7, 5, 11, 3, 9, 6, 12, 2, 8, 4, 10], "pins": [0, 120, 240, 240, 120, 0] * 2, "banks": [0] * 6 + [1] * 6, "bank_angle": 60},
+    ("F", 4): {"firing_order": [1, 3, 2, 4], "pins": [0, 180, 180, 0], "banks": [0, 1, 0, 1], "bank_angle": 180},
+    ("F", 6): {"firing_order": [1, 6, 2, 4, 3, 5], "pins": [0, 240, 120, 180, 60, 300], "banks": [0, 0, 0, 1, 1, 1], "bank_angle": 180},
+}
+
+
+def firing_angles(layout):
+
+    """
+    Crank angle in degrees at which each cylinder fires, counted from the first
+    cylinder's firing. Every cylinder in the firing order fires at the next top
+    dead center of its own after the previous one fired, and the order has to
+    come back to the first cylinder after exactly two turns
+    """
+
+    order = layout["firing_order"]
+    num_cylinders = len(layout["pins"])
+    if sorted(order) != list(range(1, num_cylinders + 1)):
+        raise ValueError("firing order {} doesn't name each of {} cylinders once".format(order, num_cylinders))
+
+    tdc = [(pin + bank * layout["bank_angle"]) % 360 for pin, bank in zip(layout["pins"], layout["banks"])]
+    fired = [0] * num_cylinders
+    angle = 0
+    for previous, cylinder in zip(order, order[1:] + order[:1]):
+        gap = (tdc[cylinder - 1] - tdc[previous - 1]) % 360 or 360
+        angle += gap
+        if cylinder != order[0]:
+            fired[cylinder - 1] = angle
 
-    def __init__(self, bore, stroke, start_x, initial_stroke, compression_ratio, volumetric_efficiency, peak_rpm) -> None:
+    if angle != 720:
+        raise ValueError("firing order {} takes {} degrees instead of 720".format(order, angle))
+    return fired
+
+
+class CylinderBank:
+
+    """
+    Holds the state of every cylinder on a crankshaft as contiguous NumPy arrays
+    so the gas, force and position updates run for all cylinders in one pass;
+    Cylinder objects are views onto a single index of a bank
+    """
+
+    def __init__(self, num_cylinders, bore, stroke, compression_ratio, volumetric_efficiency, peak_rpm) -> None:
 
         self.TIME_STEP = 0
-        
-        # cylinder stats
-        self.radius = bore / 2 
-        self.stroke = stroke 
+
+        # cylinder stats (shared by every cylinder in the bank)
+        self.num_cylinders = num_cylinders
+        self.radius = bore / 2
+        self.area = self.radius**2 * pi
+        self.stroke = stroke
         self.cyl_vol = stroke * self.radius**2 * pi # displacement volume
         self.cyl_vol += self.cyl_vol / (compression_ratio - 1) # add clearance volume
-        self.mass = 1 
-        self.ve = volumetric_efficiency 
+        self.mass = 1
+        self.ve = volumetric_efficiency
         self.peak_rpm = peak_rpm
 
+        # realtime stats, one element per cylinder
+        self.x = np.zeros(num_cylinders) # m
+        self.total_mols = np.zeros(num_cylinders) # moles
+        self.kg_of_gas = np.zeros(num_cylinders)
+        self.kg_of_air = np.zeros(num_cylinders)
+        self.pressure = np.zeros(num_cylinders)
+        self.force = np.zeros(num_cylinders)
+        self.temp = np.full(num_cylinders, ENGINE_TEMP)
+        self.available_volume = np.full(num_cylinders, self.cyl_vol)
+        self.current_stroke = np.zeros(num_cylinders)
+
+        self.fuel_used = 0 # kg of gas injected by all cylinders so far
+
+
+    def air_charge(self, throttle, rpm):
+
+        # kg of air a cylinder takes in on one intake stroke
+        return throttle * self.ve * self.cyl_vol / max(1, (rpm / self.peak_rpm))**0.9 * 1.293
+
+
+    def update(self, spark):
+
+        """
+        Vectorized version of Cylinder.update for every cylinder at once; spark is
+        a boolean array that is True for cylinders on their power stroke
+        """
+
+        old_available_vol = self.available_volume
+        self.available_volume = self.cyl_vol - (self.area * self.x) # m^3
+
+        # prevents intake stroke from adding significant torque
+        np.copyto(self.available_volume, self.cyl_vol, where=self.current_stroke == 1)
+
+        # polytropic process equation only works if pressure and moles are not 0
+        polytropic = (self.pressure != 0) & (self.total_mols != 0) & ~spark
+
+        # handles power strokes and when previous iteration's pressure is 0
+        pressure = self.total_mols * R * (self.temp) / (self.available_volume) * 0.2
+
+        y = 1.4
+        n = 1 / (1 - y)
+        np.copyto(pressure, (self.pressure * old_available_vol**n) / self.available_volume**n, where=polytropic) # polytropic process equation: PV^n = constant
+        np.divide(pressure * self.available_volume, self.total_mols, out=self.temp, where=polytropic) # ideal gas law
+        np.divide(self.temp, R, out=self.temp, where=polytropic)
+
+        self.pressure = pressure
+        self.force = pressure * self.area # N/m^2 * m^2 = N
+
+
+def _bank_field(name):
+
+    # property that reads and writes this cylinder's element of the bank array called name
+    def get(self):
+        return getattr(self.bank, name)[self.index]
+
+    def set(self, value):
+        getattr(self.bank, name)[self.index] = value
+
+    return property(get, set)
+
+
+class Cylinder:
+
+    # a view holds no state of its own beyond these, so it skips the per-instance __dict__
+    __slots__ = ("TIME_STEP", "bank", "index", "radius", "stroke", "cyl_vol", "mass", "ve", "peak_rpm")
+
+    x = _bank_field("x") # m
+    total_mols = _bank_field("total_mols") # moles
+    kg_of_gas = _bank_field("kg_of_gas")
+    kg_of_air = _bank_field("kg_of_air")
+    pressure = _bank_field("pressure")
+    force = _bank_field("force")
+    temp = _bank_field("temp")
+    available_volume = _bank_field("available_volume")
+    current_stroke = _bank_field("current_stroke")
+
+    def __init__(self, bore, stroke, start_x, initial_stroke, compression_ratio, volumetric_efficiency, peak_rpm, bank=None, index=0) -> None:
+
+        self.TIME_STEP = 0
+
+        # a standalone cylinder gets a bank of its own
+        if bank is None:
+            bank = CylinderBank(1, bore, stroke, compression_ratio, volumetric_efficiency, peak_rpm)
+        self.bank = bank
+        self.index = index
+        
+        # cylinder stats
+        self.radius = bank.radius
+        self.stroke = bank.stroke
+        self.cyl_vol = bank.cyl_vol
+        self.mass = bank.mass
+        self.ve = bank.ve
+        self.peak_rpm = bank.peak_rpm
+
         self.x = start_x # m
         
         # realtime stats
@@ -37,8 +189,9 @@ class Cylinder:
         self.current_stroke = initial_stroke
 
     def inject(self, throttle, rpm):
-        self.kg_of_air = throttle * self.ve * self.cyl_vol / max(1, (rpm / self.peak_rpm))**0.9 * 1.293 # kg
+        self.kg_of_air = self.bank.air_charge(throttle, rpm) # kg
         self.kg_of_gas = self.kg_of_air / 14.7 # use air:fuel ratio to get kg of gas
+        self.bank.fuel_used += self.kg_of_gas
         self.total_mols = (self.kg_of_air / 0.029) + (self.kg_of_gas / 0.114) # convert air and gas to moles (air is 0.029 kg/mol, gas is 0.114 kg/mol)
 
     
@@ -119,11 +272,30 @@ class Crankshaft:
 
         self.check_angles = np.zeros(num_cylinders) # angles that must be passed for each cylinder to move to the next stroke
 
+        # stroke changes are scheduled in a heap of (crank travel, cylinder) so a step
+        # without one only compares the total travel against the earliest entry
+        self.travel = 0 # radians turned since the start
+        self.stroke_events = [(self.check_angles[i] - self.angles[i], i) for i in range(num_cylinders)]
+        heapq.heapify(self.stroke_events)
+
+        # fire stroke changes at the point inside the step where their angle is crossed
+        # (see fire_interpolated_strokes) instead of at the start of the following step
+        self.interpolate_events = False
+
+        # seconds the crankshaft has run, and when set to a list, the (time, cylinder, stroke)
+        # of every stroke change from then on
+        self.elapsed = 0
+        self.event_log = None
+
+        # set by use_cycle_cache(): only the first cylinder is simulated
+        self.cycle_cache = False
+
         
-        # initialize starting positions of pistons
+        # initialize starting positions of pistons; cylinder state lives in the bank
+        self.bank = CylinderBank(num_cylinders, bore, stroke, compression_ratio, volumetric_efficiency, peak_rpm)
         for i in range(num_cylinders):
             start_x = self.crank_length * np.cos(self.angles[i]) + self.crank_length
-            self.cylinders[i] = Cylinder(bore, stroke, start_x, self.stroke_list[i], compression_ratio, volumetric_efficiency, peak_rpm)
+            self.cylinders[i] = Cylinder(bore, stroke, start_x, self.stroke_list[i], compression_ratio, volumetric_efficiency, peak_rpm, self.bank, i)
 
         self.theta = 0 
         self.omega = 0 
@@ -138,19 +310,15 @@ class Crankshaft:
     
     # sets up angles and strokes for each cylinder
     def configuration_setup(self, config, num_cylinders):
-        
-        if config == "I" and num_cylinders == 4: # firing order = 1, 3, 4, 2
-            
-            self.angles = np.array([0, -3 * pi, -pi, -2 * pi])
-            self.stroke_list = np.array([3.0, 3.0, 3.0, 3.0])
-            self.stroke_list += (self.angles) / (pi)
 
-        
-        elif config == "I" and num_cylinders == 6: # firing order = 1, 5, 3, 6, 2, 4
-            
-            self.angles = np.radians([0, -480, -240, -600, -120, -360])
-            self.stroke_list = np.array([3.0, 3.0, 3.0, 3.0, 3.0, 3.0])
-            self.stroke_list += (self.angles) / (pi)
+        layout = LAYOUTS.get((config, num_cylinders))
+        if layout is None:
+            raise ValueError("no {}{} layout; known layouts: {}".format(config, num_cylinders, ", ".join(c + str(n) for c, n in LAYOUTS)))
+
+        # a cylinder that fires later in the cycle starts further behind the first one
+        self.angles = np.radians([-angle for angle in firing_angles(layout)])
+        self.stroke_list = np.full(num_cylinders, 3.0)
+        self.stroke_list += (self.angles) / (pi)
 
         
     def update(self, torque_loss):
@@ -164,33 +332,195 @@ class Crankshaft:
             - strokes for each cylinder
             """
 
-            self.torque = np.sum(self.torque_list) - torque_loss
+            self.torque = self.torque_list.sum() - torque_loss
             self.alpha = self.torque / self.moment
             self.omega += self.alpha * self.TIME_STEP
             self.angles += self.omega * self.TIME_STEP
+            self.travel += self.omega * self.TIME_STEP
 
-            for i in range(len(self.cylinders)):
-                self.cylinders[i].x = self.crank_length * np.cos(self.angles[i]) + self.crank_length
-            
-            for i in range(len(self.cylinders)):
-                self.torque_list[i] = self.crank_length * self.cylinders[i].force * np.sin(self.angles[i])
+            # piston positions and torques for every cylinder at once
+            bank.x = self.crank_length * np.cos(self.angles) + self.crank_length
+            self.torque_list = self.crank_length * bank.force * np.sin(self.angles)
 
             self.stroke_list += (self.omega * self.TIME_STEP) / pi
             self.stroke_list %= 4
 
-        # handles stroke changes
-        for j in range(len(self.cylinders)):
+        bank = self.bank
+
+        if self.interpolate_events:
+            old_omega = self.omega
+            update_properties()
+            self.fire_interpolated_strokes(old_omega)
+        else:
+            self.fire_strokes()
+            update_properties()
+        self.elapsed += self.TIME_STEP
+
+
+    def fire_strokes(self):
+
+        """
+        Handles stroke changes for the cylinders that passed their check angle
+        during the previous step. The heap only says which cylinders are close;
+        the angle check itself decides, so rounding in the travel never moves an
+        event
+        """
 
+        events = self.stroke_events
+        if not events or events[0][0] > self.travel + EVENT_MARGIN:
+            return
+
+        candidates = []
+        while events and events[0][0] <= self.travel + EVENT_MARGIN:
+            candidates.append(heapq.heappop(events)[1])
+
+        for j in candidates:
             if self.angles[j] >= self.check_angles[j]:
-                rpm = 60 * self.omega / (2 * pi)
-                self.cylinders[j].stroke_behavior(floor(self.stroke_list[j]), self.throttle, rpm)
+                stroke = floor(self.stroke_list[j])
+                self.cylinders[j].stroke_behavior(stroke, self.throttle, 60 * self.omega / (2 * pi))
                 self.check_angles[j] += pi
-
-        update_properties()
+                if self.event_log is not None:
+                    self.event_log.append((self.elapsed, j, stroke))
+            # rescheduling from the real angles keeps the heap from drifting
+            heapq.heappush(events, (self.travel + self.check_angles[j] - self.angles[j], j))
+
+
+    def fire_interpolated_strokes(self, old_omega):
+
+        """
+        fire_strokes() for interpolate_events, called once the crank has moved:
+        every check angle crossed during the step fires, in order, at the point
+        of the step where it was crossed (logged at that time), so a cylinder
+        fires more than once if the crank turned more than pi. Fuel is metered
+        at the rpm of the crossing, and update_torques() then gives the next
+        step the forces that follow from the events
+        """
+
+        events = self.stroke_events
+        if not events or events[0][0] > self.travel:
+            return
+
+        # the crank turned at the new omega throughout the step
+        step_angle = self.omega * self.TIME_STEP
+        start = self.travel - step_angle
+
+        while events and events[0][0] <= self.travel:
+            travel, j = heapq.heappop(events)
+            fraction = min(1, max(0, (travel - start) / step_angle)) if step_angle > 0 else 1
+            rpm = 60 * (old_omega + (self.omega - old_omega) * fraction) / (2 * pi)
+
+            # the stroke that starts at this check angle; the first one, at 0, is the power stroke
+            stroke = (3 + round(self.check_angles[j] / pi)) % 4
+            self.cylinders[j].stroke_behavior(stroke, self.throttle, rpm)
+
+            self.check_angles[j] += pi
+            if self.event_log is not None:
+                self.event_log.append((self.elapsed + fraction * self.TIME_STEP, j, stroke))
+            heapq.heappush(events, (travel + pi, j))
+
+
+    def update_torques(self):
+
+        """
+        Recomputes every cylinder's torque from the forces the cylinders were
+        just updated to. update() works these out before the cylinders are
+        stepped, so without this the torque driving a step comes from the
+        forces of the step before; that lag, not where events land within a
+        step, is what made event timing drift with TIME_STEP
+        """
+
+        self.torque_list = self.crank_length * self.bank.force * np.sin(self.angles)
+
+
+    def use_cycle_cache(self):
+
+        """
+        Records the first cylinder's force against its place in the four-stroke
+        cycle (its stroke_list value) in a table of CYCLE_BINS bins. Until the
+        first cylinder has been all the way round the cycle every cylinder is
+        still simulated; from then on only the first one is, the table is
+        refreshed every cycle so the curve follows the operating point, and
+        every other cylinder reads its force from the table at its own place
+        in the cycle and burns as much fuel as the first one
+        """
+
+        self.cycle_cache = True
+        self.cycle_ready = False
+        self.cycle_recorded = 0 # strokes the first cylinder has been recorded for
+        self.cycle_table = np.zeros(CYCLE_BINS + 1) # the last bin repeats the first, so lookups need no wrapping
+        self.cycle_phases = np.arange(CYCLE_BINS + 1) * (4 / CYCLE_BINS)
+        self.cycle_position = self.stroke_list[0]
+
+
+    def update_cycle_cache(self):
+
+        # the cycle cache's replacement for CylinderBank.update(), called after update()
+        bank = self.bank
+        first = self.cylinders[0]
+        start, start_force = self.cycle_position, bank.force[0]
+        if self.cycle_ready:
+            first.update(first.current_stroke == 3)
+        else:
+            bank.update(bank.current_stroke == 3)
+        self.cycle_position = self.stroke_list[0]
+        self.record_cycle(start, self.cycle_position, start_force, bank.force[0])
+
+        if not self.cycle_ready:
+            # an empty table would give the other cylinders no force, so they run live until it is full
+            self.cycle_recorded += (self.cycle_position - start) % 4
+            if self.cycle_recorded >= 4:
+                self.cycle_ready = True
+                self.cycle_fuel = bank.fuel_used
+                self.stroke_events = [event for event in self.stroke_events if event[1] == 0]
+                heapq.heapify(self.stroke_events)
+            return
+
+        bank.force[1:] = np.interp(self.stroke_list[1:], self.cycle_phases, self.cycle_table)
+        np.floor(self.stroke_list[1:], out=bank.current_stroke[1:])
+
+        # the other cylinders inject whenever the first one does
+        if bank.fuel_used != self.cycle_fuel:
+            bank.fuel_used += (self.num_cylinders - 1) * (bank.fuel_used - self.cycle_fuel)
+            self.cycle_fuel = bank.fuel_used
+
+
+    def record_cycle(self, start, end, start_force, end_force):
+
+        # fills the table bins the first cylinder passed this step, interpolating its force between the ends
+        if end < start:
+            end += 4
+        first = floor(start * CYCLE_BINS / 4) + 1
+        last = floor(end * CYCLE_BINS / 4)
+        if last < first:
+            return
+        bins = np.arange(first, last + 1)
+        self.cycle_table[bins % CYCLE_BINS] = start_force + (end_force - start_force) * (bins * (4 / CYCLE_BINS) - start) / (end - start)
+        self.cycle_table[CYCLE_BINS] = self.cycle_table[0]
+
+
+    def update_from_map(self, torque_map, torque_loss):
+
+        """
+        Advances the crankshaft using the mean torque from a TorqueMap at the
+        current rpm and throttle; cylinders are not stepped, so fuel_used grows
+        by what they would inject at this operating point, one charge per
+        cylinder every two turns
+        """
+
+        rpm = 60 * self.omega / (2 * pi)
+        self.torque = torque_map.torque_at(rpm, self.throttle) - torque_loss
+        self.alpha = self.torque / self.moment
+        self.omega += self.alpha * self.TIME_STEP
+        self.theta += self.omega * self.TIME_STEP
+
+        bank = self.bank
+        if rpm > 0:
+            bank.fuel_used += bank.air_charge(self.throttle, rpm) / 14.7 * bank.num_cylinders * rpm / 120 * self.TIME_STEP
 
 
     # sets TIME_STEP for each cylinder
     def set_cylinder_time_step(self, t):
+        self.bank.TIME_STEP = t
         for cyl in self.cylinders:
             cyl.TIME_STEP = t  
         
@@ -0,0 +1,180 @@
+import argparse
+import csv
+import time
+
+import numpy as np
+
+from car import Car
+
+
+# kinds of trace a drive cycle can follow
+TRACE_KINDS = ["throttle", "mph"]
+
+GASOLINE_DENSITY = 0.745 # kg/L
+LITERS_PER_GALLON = 3.785
+METERS_PER_MILE = 1609.344
+
+
+class SpeedController:
+
+    """
+    PI controller that turns a target speed into a throttle between 0 and 1;
+    the car has no brakes, so above the target it can only lift off. The
+    integral stops growing while the throttle is saturated
+    """
+
+    def __init__(self, kp=0.1, ki=0.05) -> None:
+
+        self.kp = kp
+        self.ki = ki
+        self.integral = 0
+
+
+    def throttle(self, target_mph, mph, dt):
+
+        error = target_mph - mph
+        throttle = self.kp * error + self.ki * self.integral
+        if not (throttle >= 1 and error > 0) and not (throttle <= 0 and error < 0):
+            self.integral += error * dt
+        return min(1.0, max(0.0, throttle))
+
+
+def read_trace(source, chunk_rows=10000):
+
+    """
+    Yields (kind, times, values) chunks of a drive cycle trace without loading
+    all of it. source is a CSV file with a time column and a throttle or mph
+    column, a .npy file of (time, value) rows (memory-mapped) or an array of
+    such rows; arrays and .npy files are throttle traces unless passed as a
+    (kind, array) pair
+    """
+
+    kind = "throttle"
+    if isinstance(source, tuple):
+        kind, source = source
+
+    if isinstance(source, str) and source.endswith(".csv"):
+        with open(source, newline="") as file:
+            reader = csv.DictReader(file)
+            kinds = [name for name in TRACE_KINDS if name in reader.fieldnames]
+            if "time" not in reader.fieldnames or len(kinds) != 1:
+                raise ValueError("{}: expected a time column and one of {}".format(source, ", ".join(TRACE_KINDS)))
+            kind = kinds[0]
+
+            rows = []
+            for row in reader:
+                rows.append((float(row["time"]), float(row[kind])))
+                if len(rows) == chunk_rows:
+                    times, values = np.array(rows).T
+                    yield kind, times, values
+                    rows = []
+            if rows:
+                times, values = np.array(rows).T
+                yield kind, times, values
+        return
+
+    if kind not in TRACE_KINDS:
+        raise ValueError("unknown trace kind: {}".format(kind))
+    if isinstance(source, str):
+        source = np.load(source, mmap_mode="r")
+    for start in range(0, len(source), chunk_rows):
+        chunk = np.asarray(source[start:start + chunk_rows], dtype=float)
+        yield kind, chunk[:, 0], chunk[:, 1]
+
+
+def run_cycle(source, dt, all_args=None, controller=None, chunk_rows=10000, **options):
+
+    """
+    Drives a fresh car through a drive cycle at a fixed time step and returns
+    its fuel use, tractive energy, distance, time in each gear and throughput.
+    Throttle or target speed is interpolated linearly between trace points;
+    target speeds are followed with controller (a SpeedController by default).
+    The trace is read chunk by chunk, so cycles of any length use constant
+    memory. options are Car keyword arguments; with a torque_map, fuel is the
+    map's operating-point estimate (see Crankshaft.update_from_map)
+    """
+
+    car = Car(all_args, dt, **options)
+    controller = controller or SpeedController()
+
+    fuel_start = car.engine.cs.bank.fuel_used
+    tractive_energy = 0 # J delivered through the torque converter while driving
+    distance = 0 # m
+    gear_steps = np.zeros(car.transmission.number_of_gears + 1, dtype=int)
+    squared_error = 0
+    steps = 0
+
+    wall_start = time.perf_counter()
+    kind = None
+    previous = None # last trace point of the previous chunk
+    for kind, times, values in read_trace(source, chunk_rows):
+        if previous is not None:
+            times = np.concatenate(([previous[0]], times))
+            values = np.concatenate(([previous[1]], values))
+        previous = (times[-1], values[-1])
+
+        # every step that ends inside this chunk of the trace
+        first = steps + 1
+        last = int(round(times[-1] / dt, 9))
+        if last < first:
+            continue
+        step_times = np.arange(first, last + 1) * dt
+        targets = np.interp(step_times, times, values).tolist()
+
+        gears = np.empty(len(targets), dtype=int)
+        for i, target in enumerate(targets):
+            throttle = target if kind == "throttle" else controller.throttle(target, car.mph, dt)
+            car.update(throttle)
+
+            tc = car.torque_converter
+            power = tc.output_torque * tc.turbine_omega
+            if power > 0:
+                tractive_energy += power * dt
+            distance += car.wheels.linear_speed * dt
+            gears[i] = car.transmission.current_gear
+            if kind == "mph":
+                squared_error += (car.mph - target)**2
+
+        gear_steps += np.bincount(gears, minlength=len(gear_steps))
+        steps = last
+
+    wall_seconds = time.perf_counter() - wall_start
+    simulated_seconds = steps * dt
+    fuel = car.engine.cs.bank.fuel_used - fuel_start
+    gallons = fuel / GASOLINE_DENSITY / LITERS_PER_GALLON
+    miles = distance / METERS_PER_MILE
+
+    report = {
+        "simulated_seconds": simulated_seconds,
+        "wall_seconds": wall_seconds,
+        "simulated_seconds_per_wall_second": simulated_seconds / wall_seconds if wall_seconds else np.inf,
+        "fuel_kg": float(fuel),
+        "tractive_energy_j": float(tractive_energy),
+        "distance_miles": float(miles),
+        "mpg": float(miles / gallons) if gallons else np.nan,
+        "seconds_in_gear": {gear: int(count) * dt for gear, count in enumerate(gear_steps) if gear and count},
+    }
+    if kind == "mph" and steps:
+        report["rms_speed_error_mph"] = float(squared_error / steps)**0.5
+    return report
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Drive a car through a throttle or target speed trace")
+    parser.add_argument("trace", help="CSV file with time and throttle or mph columns, or a .npy throttle trace")
+    parser.add_argument("--dt", type=float, default=1e-3)
+    parser.add_argument("--parameters", default="parameters.txt")
+    parser.add_argument("--chunk-rows", type=int, default=10000)
+    parser.add_argument("--torque-map", action="store_true", help="drive the engine from its cached torque map")
+    args = parser.parse_args()
+
+    all_args = Car.read_parameters(args.parameters)
+    options = {}
+    if args.torque_map:
+        from torque_map import cached_torque_map
+        options["torque_map"] = cached_torque_map(all_args[0])
+
+    report = run_cycle(args.trace, args.dt, all_args, chunk_rows=args.chunk_rows, **options)
+    for name, value in report.items():
+        print("{}: {}".format(name, value))
@@ -1,12 +1,5 @@
 from crankshaft_cylinder import Crankshaft
 
-import sys
-import numpy as np
-import matplotlib.pyplot as plt
-import time
-import math
-import copy
-
 
 class Engine:
 
@@ -20,20 +13,31 @@ class Engine:
         # engine stats
         self.hp = 0
         self.torque = 0
+
+        # when set, a TorqueMap drives the crankshaft instead of the cylinders
+        self.torque_map = None
         
     def update(self, throttle, torque_loss):
         
         # update crankshaft
         self.cs.throttle = throttle
-        self.cs.update(torque_loss)
-        
-        # update each cylinder; spark is True when current_stroke == 3 (power stroke)
-        for cyl in self.cs.cylinders:
-            spark = False
-            match cyl.current_stroke:
-                case 3:
-                    spark = True
-            cyl.update(spark)
+
+        if self.torque_map is not None:
+            self.cs.update_from_map(self.torque_map, torque_loss)
+
+        else:
+            self.cs.update(torque_loss)
+
+            # update every cylinder at once; spark is True when current_stroke == 3 (power stroke)
+            bank = self.cs.bank
+            if self.cs.cycle_cache:
+                self.cs.update_cycle_cache()
+            else:
+                bank.update(bank.current_stroke == 3)
+
+            # with interpolated events, the next step is driven by the forces just computed
+            if self.cs.interpolate_events:
+                self.cs.update_torques()
 
         self.hp = self.cs.torque * self.cs.omega / 745.7
         self.torque = self.cs.torque
@@ -0,0 +1,218 @@
+import argparse
+import concurrent.futures
+import math
+import os
+import time
+
+import numpy as np
+
+from car import Car, QUARTER_MILE
+from sweep import apply_overrides
+from transmission import ShiftMap
+
+
+# run_until() stop conditions for each metric the optimizer can minimize
+TARGETS = {
+    "zero_to_sixty": {"mph": 60},
+    "zero_to_hundred": {"mph": 100},
+    "quarter_mile": {"distance": QUARTER_MILE},
+}
+
+# search ranges; later gears are a gear_step fraction of the one before, so ratios always fall
+DEFAULT_BOUNDS = {
+    "final_drive_ratio": (2.5, 5.0),
+    "first_gear": (2.5, 5.0),
+    "gear_step": (0.55, 0.9),
+    "shift_rpm": (3000, 8000),
+}
+
+
+def shift_points_map(upshift_rpm):
+
+    """
+    Shift map that upshifts from gear g once the engine passes upshift_rpm[g - 1]
+    at any throttle and speed, and never downshifts
+    """
+
+    number_of_gears = len(upshift_rpm) + 1
+    upshift = [[[(float(rpm), 0.0)]] for rpm in upshift_rpm] + [[[]]]
+    return ShiftMap([1], upshift, [[[]] for _ in range(number_of_gears)])
+
+
+class Candidate:
+
+    # one point in the search space, decoded from a vector of numbers between 0 and 1
+    def __init__(self, vector, number_of_gears, bounds, shift_points) -> None:
+
+        def scale(name, value):
+            low, high = bounds[name]
+            return low + (high - low) * value
+
+        self.final_drive_ratio = scale("final_drive_ratio", vector[0])
+        self.ratio_list = [scale("first_gear", vector[1])]
+        for value in vector[2:number_of_gears + 1]:
+            self.ratio_list.append(self.ratio_list[-1] * scale("gear_step", value))
+        self.shift_rpm = [float(scale("shift_rpm", value)) for value in vector[number_of_gears + 1:]] if shift_points else None
+
+
+    def overrides(self):
+
+        # the sweep.apply_overrides() parameters of this candidate
+        overrides = {
+            "final_drive_ratio": round(float(self.final_drive_ratio), 4),
+            "ratio_list": [round(float(ratio), 4) for ratio in self.ratio_list],
+        }
+        if self.shift_rpm is not None:
+            overrides["shift_map"] = shift_points_map([round(rpm) for rpm in self.shift_rpm])
+        return overrides
+
+
+    def describe(self):
+
+        # overrides() with the shift points as plain numbers
+        description = self.overrides()
+        if self.shift_rpm is not None:
+            description["shift_map"] = [round(rpm) for rpm in self.shift_rpm]
+        return description
+
+
+def evaluate(all_args, target, dt, max_time, throttle):
+
+    """
+    Runs one candidate until it reaches the target metric; returns the time it
+    took (inf when it didn't within max_time) and the seconds simulated. Runs
+    in a worker process
+    """
+
+    result = Car(all_args).run_until(max_time=max_time, dt=dt, throttle=throttle, **TARGETS[target])
+    if result["stop"] == "max_time":
+        return math.inf, result["time"]
+    return result["time"], result["time"]
+
+
+def optimize(target="zero_to_sixty", all_args=None, dt=1e-3, max_time=30, throttle=1, population=24, generations=20,
+             shift_points=True, bounds=None, mutation=0.7, crossover=0.9, seed=None, workers=None, progress=True):
+
+    """
+    Minimizes the target metric (see TARGETS) over the gear ratios, final drive
+    ratio and, with shift_points, the upshift rpm of every gear, using
+    differential evolution: each generation, every member of the population
+    gets a trial made from three others and is replaced by it if the trial is
+    at least as quick. The trials of a generation run in parallel across a
+    process pool, each only until it reaches the target, and a trial that
+    hasn't by the time its parent did is stopped right there, since it
+    couldn't win anyway. Returns the best configuration next to the vehicle's
+    own time, the convergence history and how many evaluations ran per second
+    """
+
+    if all_args is None:
+        all_args = Car.read_parameters("parameters.txt")
+    if target not in TARGETS:
+        raise ValueError("unknown target {}; expected one of {}".format(target, ", ".join(TARGETS)))
+    bounds = dict(DEFAULT_BOUNDS, **(bounds or {}))
+
+    number_of_gears = all_args[2][0]
+    dimensions = 1 + number_of_gears + (number_of_gears - 1 if shift_points else 0)
+    rng = np.random.default_rng(seed)
+
+    def candidate(vector):
+        return Candidate(vector, number_of_gears, bounds, shift_points)
+
+    history = []
+    evaluations = 0
+    simulated_seconds = 0
+    pruned = 0
+    start = time.perf_counter()
+
+    with concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+
+        def evaluate_all(vectors, budgets):
+            nonlocal evaluations, simulated_seconds
+            futures = [
+                pool.submit(evaluate, apply_overrides(all_args, candidate(vector).overrides()), target, dt, budget, throttle)
+                for vector, budget in zip(vectors, budgets)
+            ]
+            results = [future.result() for future in futures]
+            evaluations += len(results)
+            simulated_seconds += sum(seconds for _, seconds in results)
+            return np.array([metric for metric, _ in results])
+
+        # the vehicle as configured, for comparison
+        baseline = pool.submit(evaluate, all_args, target, dt, max_time, throttle)
+
+        vectors = rng.random((population, dimensions))
+        scores = evaluate_all(vectors, [max_time] * population)
+        baseline_time, seconds = baseline.result()
+        evaluations += 1
+        simulated_seconds += seconds
+
+        for generation in range(generations + 1):
+            finite = scores[np.isfinite(scores)]
+            best = int(np.argmin(scores))
+            history.append({
+                "generation": generation,
+                "evaluations": evaluations,
+                "best": float(scores[best]),
+                "median": float(np.median(finite)) if len(finite) else math.inf,
+                "pruned": pruned,
+            })
+            if progress:
+                print("generation {}: best {:.4f} s, median {:.4f} s, {} evaluations, {} pruned".format(
+                    generation, history[-1]["best"], history[-1]["median"], evaluations, pruned))
+            if generation == generations:
+                break
+
+            # DE/rand/1/bin trials, clipped to the search box
+            trials = np.empty_like(vectors)
+            for i in range(population):
+                a, b, c = rng.choice([j for j in range(population) if j != i], 3, replace=False)
+                mutant = np.clip(vectors[a] + mutation * (vectors[b] - vectors[c]), 0, 1)
+                crossing = rng.random(dimensions) < crossover
+                crossing[rng.integers(dimensions)] = True
+                trials[i] = np.where(crossing, mutant, vectors[i])
+
+            # a trial only has to run as long as its parent took (to the end of that step)
+            budgets = [min(max_time, score + dt) if np.isfinite(score) else max_time for score in scores]
+            trial_scores = evaluate_all(trials, budgets)
+            pruned += int(np.count_nonzero(~np.isfinite(trial_scores) & np.isfinite(scores)))
+
+            better = trial_scores <= scores
+            vectors[better] = trials[better]
+            scores[better] = trial_scores[better]
+
+    wall_seconds = time.perf_counter() - start
+    best = int(np.argmin(scores))
+    return {
+        "target": target,
+        "baseline_time": float(baseline_time),
+        "best_time": float(scores[best]),
+        "best": candidate(vectors[best]).describe(),
+        "history": history,
+        "evaluations": evaluations,
+        "pruned": pruned,
+        "wall_seconds": wall_seconds,
+        "evaluations_per_second": evaluations / wall_seconds,
+        "simulated_seconds_per_wall_second": simulated_seconds / wall_seconds,
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Search gear ratios, final drive and shift points for the quickest launch")
+    parser.add_argument("--target", choices=list(TARGETS), default="zero_to_sixty")
+    parser.add_argument("--parameters", default="parameters.txt")
+    parser.add_argument("--dt", type=float, default=1e-3)
+    parser.add_argument("--max-time", type=float, default=30)
+    parser.add_argument("--throttle", type=float, default=1)
+    parser.add_argument("--population", type=int, default=24)
+    parser.add_argument("--generations", type=int, default=20)
+    parser.add_argument("--no-shift-points", action="store_true", help="keep the vehicle's own shift schedule")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    result = optimize(args.target, Car.read_parameters(args.parameters), args.dt, args.max_time, args.throttle, args.population,
+                      args.generations, not args.no_shift_points, seed=args.seed, workers=args.workers)
+    for name, value in result.items():
+        if name != "history":
+            print("{}: {}".format(name, value))
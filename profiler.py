@@ -0,0 +1,180 @@
+import collections
+import json
+import math
+import time
+
+import numpy as np
+
+
+class Profiler:
+
+    """
+    Records cumulative wall time and call counts for each subsystem of a Car,
+    plus counters for stroke transitions, sparks, injections, exhausts, shift
+    requests, upshifts and downshifts. It works by wrapping the parts' update
+    methods on the instances themselves, so a car without a profiler runs
+    exactly the uninstrumented code
+    """
+
+    def __init__(self) -> None:
+
+        self.times = collections.defaultdict(float) # seconds
+        self.calls = collections.defaultdict(int)
+        self.events = collections.defaultdict(int)
+        self.wrapped = []
+
+
+    def timed(self, name, method):
+
+        times = self.times
+        calls = self.calls
+        clock = time.perf_counter
+
+        def wrapper(*args):
+            start = clock()
+            result = method(*args)
+            times[name] += clock() - start
+            calls[name] += 1
+            return result
+
+        return wrapper
+
+
+    def wrap(self, obj, method_name, wrapper):
+        setattr(obj, method_name, wrapper)
+        self.wrapped.append((obj, method_name))
+
+
+    def attach(self, car):
+
+        """
+        Instruments car's current parts; called again by Car.initialize() when
+        the parts are rebuilt
+        """
+
+        self.detach()
+
+        cs = car.engine.cs
+        bank = cs.bank
+        transmission = car.transmission
+        events = self.events
+
+        self.wrap(car, "update", self.timed("car", car.update))
+        self.wrap(car, "finish_shift", self.timed("shift_propagation", car.finish_shift))
+        self.wrap(car.engine, "update", self.timed("engine", car.engine.update))
+        self.wrap(bank, "update", self.timed("cylinder_thermodynamics", bank.update))
+        self.wrap(cs, "update_from_map", self.timed("torque_map", cs.update_from_map))
+        self.wrap(car.torque_converter, "update", self.timed("torque_converter", car.torque_converter.update))
+        self.wrap(transmission, "update", self.timed("transmission", transmission.update))
+        self.wrap(car.wheels, "update", self.timed("wheels", car.wheels.update))
+
+        def count(last, counts):
+            # last is each cylinder's stroke after the step, counts how many strokes it moved on by
+            for k in range(int(counts.max())):
+                strokes = (last - k)[counts > k] % 4
+                events["stroke_transitions"] += len(strokes)
+                events["injections"] += int((strokes == 1).sum())
+                events["sparks"] += int((strokes == 3).sum())
+                events["exhausts"] += int((strokes == 0).sum())
+
+        # stroke events are found by which cylinders moved on to their next check angle
+        crankshaft_update = self.timed("crankshaft", cs.update)
+
+        def count_strokes(*args):
+            check_angles = cs.check_angles.copy()
+            crankshaft_update(*args)
+            fired = cs.check_angles != check_angles
+            if fired.any():
+                # with interpolated events a cylinder changes stroke once for every pi the crank turned
+                count(bank.current_stroke[fired], np.rint((cs.check_angles[fired] - check_angles[fired]) / math.pi))
+
+        # once the cycle cache is ready only the first cylinder has check angles; the rest follow its table
+        cycle_cache_update = self.timed("cycle_cache", cs.update_cycle_cache)
+
+        def count_cached_strokes(*args):
+            ready = cs.cycle_ready
+            strokes = bank.current_stroke[1:].copy()
+            cycle_cache_update(*args)
+            if ready:
+                counts = (bank.current_stroke[1:] - strokes) % 4
+                if counts.any():
+                    count(bank.current_stroke[1:], counts)
+
+        self.wrap(cs, "update_cycle_cache", count_cached_strokes)
+        self.wrap(cs, "update", count_strokes)
+
+        shifting_logic = self.timed("shift_logic", transmission.shifting_logic)
+
+        # the logic asks for the shift on every step until it happens, so only the first ask counts
+        def count_shift_requests(*args):
+            where_shift = shifting_logic(*args)
+            if where_shift is not None and (not transmission.shifting or where_shift != transmission.save_where_shift):
+                events["shift_requests"] += 1
+            return where_shift
+
+        self.wrap(transmission, "shifting_logic", count_shift_requests)
+
+        switch_gears = transmission.switch_gears
+
+        def count_shifts(up):
+            if up:
+                events["upshifts"] += 1
+            elif up is not None:
+                events["downshifts"] += 1
+            return switch_gears(up)
+
+        self.wrap(transmission, "switch_gears", count_shifts)
+
+
+    def detach(self):
+
+        # removing the instance attributes uncovers the class methods again
+        for obj, method_name in self.wrapped:
+            obj.__dict__.pop(method_name, None)
+        self.wrapped = []
+
+
+    def reset(self):
+        self.times.clear()
+        self.calls.clear()
+        self.events.clear()
+
+
+    def as_dict(self):
+        return {
+            "subsystems": {
+                name: {"seconds": self.times[name], "calls": self.calls[name]}
+                for name in sorted(self.times, key=self.times.get, reverse=True)
+            },
+            "events": dict(self.events),
+        }
+
+
+    def dump(self, path):
+
+        # machine-readable version of report()
+        with open(path, "w") as file:
+            json.dump(self.as_dict(), file, indent=2)
+
+
+    def report(self):
+
+        """
+        Returns a table of subsystems by cumulative time followed by the event
+        counts; times of nested subsystems are also included in their parents
+        (e.g. crankshaft and cylinder_thermodynamics are part of engine)
+        """
+
+        data = self.as_dict()
+        total = self.times.get("car", 0) or sum(self.times.values()) or 1
+        lines = ["{:26} {:>10} {:>7} {:>10} {:>11}".format("subsystem", "seconds", "share", "calls", "us/call")]
+        for name, stats in data["subsystems"].items():
+            per_call = stats["seconds"] / stats["calls"] * 1e6 if stats["calls"] else 0
+            lines.append("{:26} {:>10.4f} {:>7.1%} {:>10} {:>11.2f}".format(name, stats["seconds"], stats["seconds"] / total, stats["calls"], per_call))
+
+        lines.append("")
+        lines.append("{:26} {:>10}".format("event", "count"))
+        for name, count in sorted(data["events"].items()):
+            lines.append("{:26} {:>10}".format(name, count))
+
+        return "\n".join(lines)
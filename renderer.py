@@ -0,0 +1,123 @@
+import collections
+import os
+import time
+
+import numpy as np
+
+
+class EngineRenderer:
+
+    """
+    Draws the pistons of an engine with pygame at a fixed frame rate. The
+    simulation calls render() as often as it likes; a frame is only drawn once
+    the next frame is due, from a snapshot of the piston positions and strokes
+    taken at that moment. With headless=True, SDL's dummy video driver is used
+    so frames can be paced and counted without a display. Frames are paced
+    by clock, the wall clock unless given another (such as the simulated
+    time). Without an engine, layout() must be called before drawing
+    """
+
+    def __init__(self, engine, fps=60, headless=False, size=(1000, 720), clock=time.perf_counter) -> None:
+
+        if headless:
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+
+        import pygame
+        self.pygame = pygame
+
+        pygame.init()
+        self.screen = pygame.display.set_mode(size)
+        self.height = size[1]
+        if engine is not None:
+            self.layout(engine.num_cylinders, engine.cs.cylinders[0].stroke)
+
+        self.clock = clock
+        self.frame_interval = 1 / fps
+        self.next_frame = clock()
+        self.frame_times = collections.deque(maxlen=1000) # clock time of recent frames
+        self.frames = 0
+        self.closed = False
+
+
+    def layout(self, num_cylinders, stroke):
+
+        # pistons are spread across the window and their travel scaled to 200 pixels
+        self.pixel_stroke = 200 / stroke
+        self.pixel_x_list = np.linspace(200, 800, num_cylinders)
+
+
+    def render(self, engine):
+
+        """
+        Draws a frame if one is due and returns whether it did
+        """
+
+        # copy the state so the frame is consistent even if drawing is interleaved with physics
+        bank = engine.cs.bank
+        return self.render_from(lambda: (bank.x.copy(), bank.current_stroke.copy()))
+
+
+    def render_from(self, snapshot):
+
+        """
+        render() for any source of frames: snapshot() returns the piston
+        positions and strokes to draw, or None to skip drawing, and is only
+        called when a frame is due
+        """
+
+        now = self.clock()
+        if now < self.next_frame:
+            return False
+
+        # poll for events
+        # pygame.QUIT event means the user clicked X to close your window
+        for event in self.pygame.event.get():
+            if event.type == self.pygame.QUIT:
+                self.closed = True
+
+        frame = snapshot()
+        if frame is None:
+            return False
+        self.draw(*frame)
+
+        # schedule the next frame; if the renderer fell behind, don't try to catch up
+        self.next_frame += self.frame_interval
+        if self.next_frame < now:
+            self.next_frame = now + self.frame_interval
+
+        self.frame_times.append(now)
+        self.frames += 1
+        return True
+
+
+    def draw(self, x_list, stroke_list):
+
+        # fill the screen with a color to wipe away anything from last frame
+        self.screen.fill("black")
+
+        for pixel_x, x, stroke in zip(self.pixel_x_list, x_list, stroke_list):
+            color = "blue"
+            if stroke == 3:
+                color = "red"
+            self.pygame.draw.circle(self.screen, color, [pixel_x, self.height - (250 + self.pixel_stroke * x)], 40)
+
+        # flip() the display to put your work on screen
+        self.pygame.display.flip()
+
+
+    def pacing(self):
+
+        """
+        Returns the mean frame rate and the standard deviation of the frame
+        interval (seconds) over the recent frames
+        """
+
+        intervals = np.diff(self.frame_times)
+        if len(intervals) == 0:
+            return 0.0, 0.0
+        return 1 / intervals.mean(), intervals.std()
+
+
+    def close(self):
+        self.pygame.quit()
+
@@ -0,0 +1,244 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zipfile
+import zlib
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # no flock on Windows; eviction then runs unlocked
+    fcntl = None
+
+from car import Car
+from sweep import SUMMARY_FIELDS, canonical, summarize
+
+
+# bump when a change to the model makes cached results stale
+RESULT_VERSION = 1
+
+# temporary files older than this (seconds) were left by a writer that died
+STALE_TEMPORARY = 3600
+
+# what reading a truncated or otherwise damaged .npz can raise
+CORRUPT_ERRORS = (OSError, ValueError, EOFError, KeyError, zipfile.BadZipFile, zlib.error)
+
+
+def file_digest(file_name):
+    with open(file_name, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+class ResultCache:
+
+    """
+    On-disk cache of Car runs, keyed by a hash of everything that decides a
+    run's result: the four argument groups (and the contents of a shift map
+    file), dt, duration, the throttle (constant or trace), the Car options
+    and RESULT_VERSION. Each result is a compressed .npz file in directory;
+    hits touch the file, and once the files add up to more than max_bytes the
+    least recently used ones are removed. Results are written to a temporary
+    file and renamed into place, and eviction holds an flock on a lock file,
+    so any number of processes can share one directory
+    """
+
+    def __init__(self, directory="result_cache", max_bytes=1 << 30, version=RESULT_VERSION) -> None:
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+
+    def key(self, kind, all_args, dt, duration, throttle=1, **options):
+
+        # stable hash of a run; options are Car keyword arguments, which may hold NumPy values or a TorqueMap
+        throttle = np.asarray(throttle, dtype=float)
+        if throttle.ndim:
+            throttle = [list(throttle.shape), hashlib.sha1(np.ascontiguousarray(throttle).tobytes()).hexdigest()]
+        else:
+            throttle = float(throttle)
+
+        shift_map = all_args[2][3] if len(all_args[2]) > 3 else ""
+        description = json.dumps({
+            "version": self.version,
+            "kind": kind,
+            "all_args": canonical(all_args),
+            "shift_map": file_digest(shift_map) if shift_map and isinstance(shift_map, str) else "", # a ShiftMap object is in all_args
+            "dt": canonical(dt),
+            "duration": canonical(duration),
+            "throttle": throttle,
+            "options": canonical(options),
+        }, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+
+    def load(self, key, names=None):
+
+        """
+        Returns the arrays stored under key (only those in names, if given), or
+        None if there are none. An entry that can't be read, such as one
+        truncated by a full disk, is removed and counts as a miss
+        """
+
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in (data.files if names is None else names)}
+            os.utime(path) # most recently used
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except CORRUPT_ERRORS:
+            self.remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+
+    def store(self, key, arrays):
+
+        # write to a temporary file first so other processes never load half a result
+        descriptor, temporary = tempfile.mkstemp(".tmp", dir=self.directory)
+        with os.fdopen(descriptor, "wb") as file:
+            np.savez_compressed(file, **arrays)
+        os.replace(temporary, self.path(key))
+        self.evict()
+
+
+    def evict(self):
+
+        """
+        Removes the least recently used results until the cache fits in
+        max_bytes, and temporary files abandoned by dead writers
+        """
+
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            entries = []
+            now = time.time()
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    if entry.name.endswith(".npz"):
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    elif entry.name.endswith(".tmp") and now - stat.st_mtime > STALE_TEMPORARY:
+                        self.remove(entry.path)
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self.remove(path)
+                total -= size
+
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+    def run(self, all_args, duration, dt, throttle=1, **options):
+
+        """
+        Car(all_args, **options).run(duration, dt, throttle), from the cache when
+        the same run was done before; returns the TELEMETRY_FIELDS arrays and
+        stores them with their summary (see summary())
+        """
+
+        key = self.key("run", all_args, dt, duration, throttle, **options)
+        arrays = self.load(key)
+        if arrays is None:
+            arrays = self.compute_run(key, all_args, duration, dt, throttle, options)
+        return {name[len("trace_"):]: values for name, values in arrays.items() if name.startswith("trace_")}
+
+
+    def summary(self, all_args, duration, dt, throttle=1, **options):
+
+        # the SUMMARY_FIELDS of run(), without loading the traces on a hit
+        key = self.key("run", all_args, dt, duration, throttle, **options)
+        arrays = self.load(key, ["summary_" + name for name in SUMMARY_FIELDS])
+        if arrays is None:
+            arrays = self.compute_run(key, all_args, duration, dt, throttle, options)
+        return {name: arrays["summary_" + name][()] for name in SUMMARY_FIELDS}
+
+
+    def compute_run(self, key, all_args, duration, dt, throttle, options):
+
+        # runs the car and stores its traces and summary under key
+        telemetry = Car(all_args, **options).run(duration, dt, throttle)
+        arrays = {"trace_" + field: values for field, values in telemetry.items()}
+        arrays.update({"summary_" + name: np.asarray(value) for name, value in summarize(telemetry).items()})
+        self.store(key, arrays)
+        return arrays
+
+
+    def performance_metrics(self, all_args, dt, max_time=60, throttle=1, **options):
+
+        # Car.performance_metrics(), from the cache when the same run was done before
+        key = self.key("metrics", all_args, dt, max_time, throttle, **options)
+        arrays = self.load(key)
+        if arrays is None:
+            metrics = Car(all_args, **options).performance_metrics(dt, max_time, throttle)
+            arrays = {name: np.asarray(value) for name, value in metrics.items()}
+            self.store(key, arrays)
+        return {name: float(value) for name, value in arrays.items()}
+
+
+    def size(self):
+
+        # number of cached results and their total size in bytes
+        sizes = [entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith(".npz")]
+        return len(sizes), sum(sizes)
+
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                self.remove(entry.path)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run the car through the result cache, or inspect the cache")
+    parser.add_argument("--dir", default="result_cache")
+    parser.add_argument("--parameters", default="parameters.txt")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--dt", type=float, default=1e-4)
+    parser.add_argument("--throttle", type=float, default=1)
+    parser.add_argument("--max-mb", type=float, default=1024)
+    parser.add_argument("--clear", action="store_true", help="remove every cached result and exit")
+    args = parser.parse_args()
+
+    cache = ResultCache(args.dir, int(args.max_mb * 2**20))
+    if args.clear:
+        cache.clear()
+    else:
+        start = time.perf_counter()
+        summary = cache.summary(Car.read_parameters(args.parameters), args.duration, args.dt, args.throttle)
+        seconds = time.perf_counter() - start
+        for name, value in summary.items():
+            print("{}: {}".format(name, value))
+        print("{} in {:.3f} s".format("hit" if cache.hits else "miss", seconds))
+
+    count, size = cache.size()
+    print("{} results, {:.1f} MB".format(count, size / 2**20))
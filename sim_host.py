@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import collections
+import json
+import time
+
+import numpy as np
+
+from car import Car
+
+
+# telemetry sent to subscribers after every batch of steps
+STREAM_FIELDS = {
+    "time": lambda car: car.time,
+    "engine_rpm": lambda car: car.engine_rpm,
+    "mph": lambda car: car.mph,
+    "gear": lambda car: car.transmission.current_gear,
+    "throttle": lambda car: car.throttle,
+}
+
+
+class HostedCar:
+
+    # a car run by a SimulationHost, with its throttle command and pacing statistics
+    def __init__(self, car_id, car) -> None:
+
+        self.car_id = car_id
+        self.car = car
+        self.throttle = 0
+        self.car.throttle = 0
+
+        self.batches = 0
+        self.steps = 0
+        self.catch_up_batches = 0 # batches that took extra steps to catch up with the wall clock
+        self.missed_deadlines = 0 # batches that started after their deadline
+        self.dropped_seconds = 0 # simulated time given up when too far behind to catch up
+        self.lateness = collections.deque(maxlen=1000) # seconds recent batches started after their deadline
+
+
+class SimulationHost:
+
+    """
+    Runs many cars as asyncio tasks in one thread, each paced to wall-clock
+    time. Every period seconds a car's task wakes up and steps its car for the
+    simulated time that has passed, which is one batch of period / dt steps
+    when it is on time and more (up to max_catch_up batches) when it fell
+    behind; anything further behind is dropped rather than letting the car fall
+    further and further behind. Clients connect over TCP or a Unix socket and
+    exchange JSON lines, see handle_client()
+    """
+
+    def __init__(self, dt=2e-3, period=0.02, max_catch_up=4, use_torque_map=True, all_args=None) -> None:
+
+        self.dt = dt
+        self.period = period
+        self.max_catch_up = max_catch_up
+        self.use_torque_map = use_torque_map
+        self.all_args = all_args
+
+        self.cars = {}
+        self.tasks = {}
+        self.subscribers = {} # client queue -> set of car ids, or None for every car
+        self.clients = {} # client stream writer -> its handler task
+        self.dropped_messages = 0
+
+
+    def add_car(self, car_id, all_args=None):
+
+        """
+        Builds a car and starts its task; the car begins at zero throttle.
+        Must be called with the event loop running, and car_id must be new
+        """
+
+        if car_id in self.cars:
+            raise ValueError("car {} already exists".format(car_id))
+        car = Car(all_args or self.all_args, self.dt)
+        if self.use_torque_map:
+            car.use_torque_map()
+        hosted = HostedCar(car_id, car)
+        self.cars[car_id] = hosted
+        self.tasks[car_id] = asyncio.get_running_loop().create_task(self.drive(hosted))
+        return hosted
+
+
+    def remove_car(self, car_id):
+        self.tasks.pop(car_id).cancel()
+        del self.cars[car_id]
+
+
+    def set_throttle(self, car_id, throttle):
+        self.cars[car_id].throttle = min(1.0, max(0.0, float(throttle)))
+
+
+    async def drive(self, hosted):
+
+        # the pacing loop of one car
+        loop = asyncio.get_running_loop()
+        car = hosted.car
+        dt = self.dt
+        start = loop.time()
+        deadline = start
+        steps_done = 0
+        steps_per_batch = max(1, round(self.period / dt))
+
+        while True:
+            now = loop.time()
+            late = now - deadline
+            hosted.lateness.append(late)
+            if late > self.period:
+                hosted.missed_deadlines += 1
+
+            # step to where the wall clock is, within the catch-up limit
+            due = int((now - start) / dt) - steps_done
+            if due > steps_per_batch * self.max_catch_up:
+                hosted.dropped_seconds += (due - steps_per_batch * self.max_catch_up) * dt
+                steps_done += due - steps_per_batch * self.max_catch_up
+                due = steps_per_batch * self.max_catch_up
+            if due > steps_per_batch:
+                hosted.catch_up_batches += 1
+
+            throttle = hosted.throttle
+            for _ in range(due):
+                car.update(throttle)
+            steps_done += due
+            hosted.steps += due
+            hosted.batches += 1
+
+            if self.subscribers:
+                self.publish(hosted)
+
+            deadline += self.period
+            if deadline < loop.time():
+                # too late for this deadline; start again from now instead of bursting
+                deadline = loop.time()
+            await asyncio.sleep(deadline - loop.time())
+
+
+    def publish(self, hosted):
+
+        message = None
+        for queue, car_ids in self.subscribers.items():
+            if car_ids is not None and hosted.car_id not in car_ids:
+                continue
+            if message is None:
+                message = {"car": hosted.car_id}
+                message.update({field: get(hosted.car) for field, get in STREAM_FIELDS.items()})
+                message = json.dumps(message, default=float) + "\n"
+
+            self.offer(queue, message)
+
+
+    def offer(self, queue, message):
+
+        # a slow client loses messages instead of holding up the simulation
+        if queue.full():
+            self.dropped_messages += 1
+        else:
+            queue.put_nowait(message)
+
+
+    def metrics(self):
+
+        """
+        Pacing statistics over all cars: deadlines missed by more than a period,
+        catch-up batches, simulated time dropped, and the mean, standard
+        deviation and maximum of how late batches started (step jitter)
+        """
+
+        lateness = np.array([late for hosted in self.cars.values() for late in hosted.lateness])
+        return {
+            "cars": len(self.cars),
+            "batches": sum(hosted.batches for hosted in self.cars.values()),
+            "steps": sum(hosted.steps for hosted in self.cars.values()),
+            "missed_deadlines": sum(hosted.missed_deadlines for hosted in self.cars.values()),
+            "catch_up_batches": sum(hosted.catch_up_batches for hosted in self.cars.values()),
+            "dropped_seconds": sum(hosted.dropped_seconds for hosted in self.cars.values()),
+            "dropped_messages": self.dropped_messages,
+            "mean_lateness_ms": float(lateness.mean() * 1000) if len(lateness) else 0.0,
+            "jitter_ms": float(lateness.std() * 1000) if len(lateness) else 0.0,
+            "max_lateness_ms": float(lateness.max() * 1000) if len(lateness) else 0.0,
+        }
+
+
+    def reset_metrics(self):
+
+        # starts a new measurement interval
+        for hosted in self.cars.values():
+            hosted.lateness.clear()
+            hosted.batches = hosted.steps = 0
+            hosted.missed_deadlines = hosted.catch_up_batches = 0
+            hosted.dropped_seconds = 0
+        self.dropped_messages = 0
+
+
+    async def handle_client(self, reader, writer):
+
+        """
+        One JSON object per line from the client:
+            {"throttle": 0.5, "car": id}   set a car's throttle
+            {"subscribe": [ids] or "all"}  stream telemetry lines for those cars
+            {"unsubscribe": true}          stop streaming
+            {"add": id} / {"remove": id}   add or remove a car
+            {"metrics": true}              reply with metrics()
+        Errors are replied as {"error": message}
+        """
+
+        queue = asyncio.Queue(maxsize=256)
+        self.clients[writer] = asyncio.current_task()
+
+        async def send():
+            while True:
+                writer.write((await queue.get()).encode())
+                await writer.drain()
+
+        sender = asyncio.get_running_loop().create_task(send())
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if "throttle" in request:
+                        self.set_throttle(request["car"], request["throttle"])
+                    if "subscribe" in request:
+                        car_ids = request["subscribe"]
+                        self.subscribers[queue] = None if car_ids == "all" else set(car_ids)
+                    if "unsubscribe" in request:
+                        self.subscribers.pop(queue, None)
+                    if "add" in request:
+                        self.add_car(request["add"])
+                    if "remove" in request:
+                        self.remove_car(request["remove"])
+                    if "metrics" in request:
+                        self.offer(queue, json.dumps({"metrics": self.metrics()}) + "\n")
+                except (ValueError, KeyError, TypeError) as error:
+                    self.offer(queue, json.dumps({"error": repr(error)}) + "\n")
+        finally:
+            self.subscribers.pop(queue, None)
+            self.clients.pop(writer, None)
+            sender.cancel()
+            writer.close()
+
+
+    async def serve(self, host="127.0.0.1", port=8765, path=None):
+
+        # listens on a Unix socket when path is given, otherwise on TCP
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle_client, path)
+        return await asyncio.start_server(self.handle_client, host, port)
+
+
+    async def shutdown(self):
+
+        # stops every car and disconnects the clients, whose handlers then finish on their own
+        for task in self.tasks.values():
+            task.cancel()
+        for writer in list(self.clients):
+            writer.close()
+        await asyncio.gather(*self.tasks.values(), *self.clients.values(), return_exceptions=True)
+
+
+async def main(args):
+
+    host = SimulationHost(args.dt, args.period, use_torque_map=not args.full_model)
+
+    # characterize (or load) the torque map once before the cars start
+    if host.use_torque_map:
+        Car(dt=args.dt).use_torque_map()
+
+    for i in range(args.cars):
+        host.add_car(i)
+    server = await host.serve(port=args.port, path=args.unix)
+
+    start = time.perf_counter()
+    while args.seconds is None or time.perf_counter() - start < args.seconds:
+        await asyncio.sleep(args.report_every)
+        print(json.dumps(host.metrics()))
+        host.reset_metrics()
+
+    server.close()
+    await host.shutdown()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve many real-time cars over a JSON lines socket")
+    parser.add_argument("--cars", type=int, default=100)
+    parser.add_argument("--dt", type=float, default=2e-3)
+    parser.add_argument("--period", type=float, default=0.02, help="seconds between a car's batches")
+    parser.add_argument("--full-model", action="store_true", help="simulate the cylinders instead of using the torque map")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="Unix socket path to listen on instead of TCP")
+    parser.add_argument("--seconds", type=float, default=None, help="stop after this long")
+    parser.add_argument("--report-every", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
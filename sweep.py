@@ -0,0 +1,232 @@
+import argparse
+import ast
+import concurrent.futures
+import copy
+import hashlib
+import inspect
+import itertools
+import json
+import os
+
+import numpy as np
+
+from car import Car
+from engine import Engine
+from torque_converter import TorqueConverter
+from transmission import Transmission
+from wheels import Wheels
+
+
+# maps each constructor argument name to its (arg group, position) in Car.all_args
+PARAMETERS = {
+    name: (group, position)
+    for group, part in enumerate([Engine, TorqueConverter, Transmission, Wheels])
+    for position, name in enumerate(list(inspect.signature(part).parameters))
+}
+
+SUMMARY_FIELDS = ["top_mph", "final_mph", "max_rpm", "peak_hp", "peak_torque", "final_gear", "zero_to_sixty"]
+
+# summary of runs with metrics=True, from Car.performance_metrics()
+METRIC_FIELDS = ["zero_to_sixty", "zero_to_hundred", "quarter_mile_time", "quarter_mile_mph", "simulated_seconds"]
+
+
+def grid(**values):
+
+    """
+    Returns one override dict for every combination of the given values,
+    e.g. grid(bore=[0.08, 0.09], final_drive_ratio=[3, 3.5]) gives 4 runs
+    """
+
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+
+def apply_overrides(all_args, overrides):
+
+    # copy all_args with each named parameter replaced
+    all_args = copy.deepcopy(all_args)
+    for name, value in overrides.items():
+        if name not in PARAMETERS:
+            raise KeyError("unknown parameter: {}".format(name))
+        group, position = PARAMETERS[name]
+        all_args[group][position] = value
+    return all_args
+
+
+def canonical(value):
+
+    """
+    JSON-ready copy of value for hashing: NumPy arrays and scalars become lists
+    and numbers, numbers become floats (so 2, 2.0 and np.float64(2) hash the
+    same), and other objects (a ShiftMap, a TorqueMap) their class name and
+    attributes
+    """
+
+    if isinstance(value, (np.ndarray, np.generic)):
+        value = value.tolist()
+    if isinstance(value, dict):
+        return {str(name): canonical(item) for name, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if hasattr(value, "__dict__"):
+        return [type(value).__name__, canonical(vars(value))]
+    return value
+
+
+def run_key(all_args, overrides, duration, dt, throttle, metrics=False):
+
+    # stable name for a run (the merged parameters and run settings), used as its file name and to skip finished runs
+    parameters = canonical(apply_overrides(all_args, overrides))
+
+    # a throttle trace is hashed by its shape and bytes, as in ResultCache.key()
+    throttle = np.asarray(throttle, dtype=float)
+    if throttle.ndim:
+        throttle = [list(throttle.shape), hashlib.sha1(np.ascontiguousarray(throttle).tobytes()).hexdigest()]
+
+    settings = canonical([duration, dt, throttle])
+    description = json.dumps([parameters] + settings + (["metrics"] if metrics else []), sort_keys=True)
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+
+def summarize(telemetry):
+
+    """
+    Reduces the arrays returned by Car.run() to a dict of SUMMARY_FIELDS
+    """
+
+    mph = telemetry["mph"]
+    time = telemetry["time"]
+
+    # 0-60 time is interpolated between the two steps around 60 mph
+    zero_to_sixty = np.nan
+    above = np.flatnonzero(mph >= 60)
+    if len(above):
+        i = above[0]
+        if i == 0:
+            zero_to_sixty = time[0]
+        else:
+            zero_to_sixty = np.interp(60, mph[i - 1:i + 1], time[i - 1:i + 1])
+
+    empty = len(mph) == 0
+    return {
+        "top_mph": np.nan if empty else mph.max(),
+        "final_mph": np.nan if empty else mph[-1],
+        "max_rpm": np.nan if empty else telemetry["engine_rpm"].max(),
+        "peak_hp": np.nan if empty else telemetry["hp"].max(),
+        "peak_torque": np.nan if empty else telemetry["torque"].max(),
+        "final_gear": np.nan if empty else telemetry["gear"][-1],
+        "zero_to_sixty": zero_to_sixty,
+    }
+
+
+def run_one(all_args, overrides, duration, dt, throttle, traces, path, metrics=False):
+
+    """
+    Runs a single configuration and writes its summary (and traces when asked)
+    to path; runs in a worker process. With metrics, the run stops as soon as
+    the performance metrics are known (or after duration) and has no traces
+    """
+
+    car = Car(apply_overrides(all_args, overrides))
+    if metrics:
+        summary = car.performance_metrics(dt, duration, throttle)
+    else:
+        telemetry = car.run(duration, dt, throttle)
+        summary = summarize(telemetry)
+
+    arrays = {name: np.asarray(value) for name, value in summary.items()}
+    arrays["overrides"] = np.asarray(json.dumps(overrides, sort_keys=True))
+    if traces and not metrics:
+        arrays.update({"trace_" + field: values for field, values in telemetry.items()})
+
+    # write to a temporary file first so an interrupted run never looks finished
+    temporary = path + ".tmp.npz"
+    np.savez(temporary, **arrays)
+    os.replace(temporary, path)
+
+    return summary
+
+
+def load_run(path, fields=SUMMARY_FIELDS):
+    with np.load(path) as data:
+        return {name: data[name][()] for name in fields + ["overrides"]}
+
+
+def sweep(overrides_list, output_dir, duration, dt, throttle=1, all_args=None, traces=False, workers=None, chunk_size=None, progress=True, metrics=False):
+
+    """
+    Runs every override dict in overrides_list on top of all_args (parameters.txt
+    by default) across a process pool. Each run is written to output_dir/runs as
+    soon as it finishes, runs already there are skipped, and the summaries of all
+    runs are collected into the columns of output_dir/summary.npz, which is returned
+    as a dict of arrays. With metrics, each run measures METRIC_FIELDS with
+    Car.performance_metrics() instead, stopping early, and duration is the
+    longest a run may take
+    """
+
+    if all_args is None:
+        all_args = Car.read_parameters("parameters.txt")
+
+    runs_dir = os.path.join(output_dir, "runs")
+    os.makedirs(runs_dir, exist_ok=True)
+
+    keys = [run_key(all_args, overrides, duration, dt, throttle, metrics) for overrides in overrides_list]
+    paths = [os.path.join(runs_dir, key + ".npz") for key in keys]
+    pending = [i for i, path in enumerate(paths) if not os.path.exists(path)]
+
+    total = len(overrides_list)
+    done = total - len(pending)
+    if progress:
+        print("{}/{} runs already finished".format(done, total))
+
+    # keep at most chunk_size runs queued so huge sweeps don't pile up in memory
+    workers = workers or os.cpu_count()
+    chunk_size = chunk_size or 4 * workers
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        queued = iter(pending)
+        in_flight = set()
+        while True:
+            for i in itertools.islice(queued, chunk_size - len(in_flight)):
+                in_flight.add(pool.submit(run_one, all_args, overrides_list[i], duration, dt, throttle, traces, paths[i], metrics))
+            if not in_flight:
+                break
+            finished, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                future.result()
+                done += 1
+                if progress:
+                    print("{}/{} runs finished".format(done, total))
+
+    fields = METRIC_FIELDS if metrics else SUMMARY_FIELDS
+    runs = [load_run(path, fields) for path in paths]
+    summary = {"key": np.array(keys)}
+    for name in fields + ["overrides"]:
+        summary[name] = np.array([run[name] for run in runs])
+
+    np.savez(os.path.join(output_dir, "summary.npz"), **summary)
+    return summary
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run a parameter sweep over a process pool")
+    parser.add_argument("output_dir")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUES",
+                        help="parameter and a Python list of values to sweep, e.g. bore=[0.08, 0.09]")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--dt", type=float, default=1e-4)
+    parser.add_argument("--throttle", type=float, default=1)
+    parser.add_argument("--traces", action="store_true", help="also save full traces for every run")
+    parser.add_argument("--metrics", action="store_true", help="measure 0-60, 0-100 and quarter mile, stopping each run early")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    args = parser.parse_args()
+
+    values = {}
+    for setting in args.set:
+        name, literal = setting.split("=", 1)
+        values[name.strip()] = ast.literal_eval(literal)
+
+    sweep(grid(**values), args.output_dir, args.duration, args.dt, args.throttle, traces=args.traces, workers=args.workers, chunk_size=args.chunk_size, metrics=args.metrics)
@@ -0,0 +1,314 @@
+import argparse
+import bisect
+import json
+import os
+import time
+
+import numpy as np
+
+from car import FIELD_GETTERS
+
+
+# scalar fields an archive records by default (see car.FIELD_GETTERS), and per-cylinder bank arrays
+ARCHIVE_FIELDS = ["time", "engine_rpm", "mph", "gear", "torque"]
+CYLINDER_FIELDS = ["pressure"]
+
+ARCHIVE_VERSION = 1
+
+# one record per finished chunk and per gear shift, appended to chunks.idx and events.idx
+CHUNK_RECORD = np.dtype([("start_row", "<i8"), ("rows", "<i8"), ("start_time", "<f8"), ("end_time", "<f8")])
+EVENT_RECORD = np.dtype([("time", "<f8"), ("row", "<i8"), ("from_gear", "<i8"), ("to_gear", "<i8")])
+
+
+def column_dtype(field):
+    return np.dtype("<i8") if field == "gear" else np.dtype("<f8")
+
+
+def read_records(file_name, dtype):
+
+    # whole records only; one that is being appended right now is left for the next read
+    with open(file_name, "rb") as file:
+        data = file.read()
+    return np.frombuffer(data[:len(data) - len(data) % dtype.itemsize], dtype)
+
+
+class ArchiveWriter:
+
+    """
+    Appends telemetry to an archive directory: one raw little-endian file per
+    field (per-cylinder fields hold a row of num_cylinders values per step),
+    written through a memory map one chunk of chunk_rows steps at a time. When
+    a chunk fills up it is published by appending its row range and time
+    range to chunks.idx, together with the gear shifts inside it in
+    events.idx, so readers only ever see finished chunks. Times must increase
+    """
+
+    def __init__(self, path, num_cylinders, fields=ARCHIVE_FIELDS, cylinder_fields=CYLINDER_FIELDS, chunk_rows=65536) -> None:
+
+        if "time" not in fields:
+            raise ValueError("an archive needs the time field")
+        if os.path.exists(os.path.join(path, "meta.json")):
+            raise FileExistsError("{} already holds an archive".format(path))
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.num_cylinders = num_cylinders
+        self.chunk_rows = chunk_rows
+        self.fields = list(fields)
+        self.cylinder_fields = list(cylinder_fields)
+
+        meta = {
+            "version": ARCHIVE_VERSION,
+            "chunk_rows": chunk_rows,
+            "num_cylinders": num_cylinders,
+            "fields": {field: column_dtype(field).str for field in self.fields},
+            "cylinder_fields": {field: "<f8" for field in self.cylinder_fields},
+        }
+        with open(os.path.join(path, "meta.json"), "w") as file:
+            json.dump(meta, file, indent=2)
+
+        self.files = {}
+        for field in self.fields + self.cylinder_fields:
+            self.files[field] = open(os.path.join(path, field + ".bin"), "w+b")
+        self.chunk_index = open(os.path.join(path, "chunks.idx"), "ab")
+        self.event_index = open(os.path.join(path, "events.idx"), "ab")
+
+        self.getters = [FIELD_GETTERS[field] for field in self.fields]
+        self.rows = 0 # rows in published chunks
+        self.row = 0 # next row within the current chunk
+        self.gear = None
+        self.events = []
+        self.map_chunk()
+
+
+    @classmethod
+    def for_car(cls, path, car, **kwargs):
+        return cls(path, car.engine.num_cylinders, **kwargs)
+
+
+    def map_chunk(self):
+
+        # grows every column file by a chunk and maps just that chunk
+        self.columns = []
+        self.cylinder_columns = []
+        for field in self.fields + self.cylinder_fields:
+            file = self.files[field]
+            shape = (self.chunk_rows, self.num_cylinders) if field in self.cylinder_fields else (self.chunk_rows,)
+            dtype = np.dtype("<f8") if field in self.cylinder_fields else column_dtype(field)
+            row_bytes = dtype.itemsize * (self.num_cylinders if field in self.cylinder_fields else 1)
+            file.truncate((self.rows + self.chunk_rows) * row_bytes)
+
+            # plain ndarray views of the map are quicker to write one element at a time than np.memmap
+            column = np.memmap(file, dtype, "r+", self.rows * row_bytes, shape)
+            if field in self.cylinder_fields:
+                self.cylinder_columns.append((column, column.view(np.ndarray), field))
+            else:
+                self.columns.append((column, column.view(np.ndarray)))
+        self.time_column = self.columns[self.fields.index("time")][1]
+
+
+    def record(self, car):
+
+        # appends the car's current state as one row
+        row = self.row
+        for (_, column), get in zip(self.columns, self.getters):
+            column[row] = get(car)
+        bank = car.engine.cs.bank
+        for _, column, field in self.cylinder_columns:
+            column[row] = getattr(bank, field)
+
+        gear = car.transmission.current_gear
+        if gear != self.gear:
+            if self.gear is not None:
+                self.events.append((car.time, self.rows + row, self.gear, gear))
+            self.gear = gear
+
+        self.row = row + 1
+        if self.row == self.chunk_rows:
+            self.publish()
+            self.map_chunk()
+
+
+    def publish(self):
+
+        # flushes the current chunk and appends it (and its gear shifts) to the indexes
+        rows = self.row
+        if not rows:
+            return
+        for column, _ in self.columns:
+            column.flush()
+        for column, _, _ in self.cylinder_columns:
+            column.flush()
+
+        chunk = np.array([(self.rows, rows, self.time_column[0], self.time_column[rows - 1])], CHUNK_RECORD)
+        self.event_index.write(np.array(self.events, EVENT_RECORD).tobytes())
+        self.event_index.flush()
+        self.chunk_index.write(chunk.tobytes())
+        self.chunk_index.flush()
+
+        self.rows += rows
+        self.row = 0
+        self.events = []
+
+
+    def close(self):
+
+        # publishes the last, partial chunk and trims the column files to the rows written
+        self.publish()
+        self.columns = self.cylinder_columns = self.time_column = None
+        for field, file in self.files.items():
+            row_bytes = 8 * (self.num_cylinders if field in self.cylinder_fields else 1)
+            file.truncate(self.rows * row_bytes)
+            file.close()
+        self.chunk_index.close()
+        self.event_index.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ArchiveReader:
+
+    """
+    Reads an archive, including one that is still being written: columns are
+    memory-mapped, so only the rows that are sliced are read from disk. refresh()
+    picks up chunks published since the reader was opened
+    """
+
+    def __init__(self, path) -> None:
+
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        if meta["version"] != ARCHIVE_VERSION:
+            raise ValueError("{}: archive version {} (expected {})".format(path, meta["version"], ARCHIVE_VERSION))
+
+        self.chunk_rows = meta["chunk_rows"]
+        self.num_cylinders = meta["num_cylinders"]
+        self.dtypes = {field: np.dtype(dtype) for field, dtype in meta["fields"].items()}
+        self.cylinder_fields = list(meta["cylinder_fields"])
+        self.dtypes.update({field: np.dtype(dtype) for field, dtype in meta["cylinder_fields"].items()})
+        self.fields = list(self.dtypes)
+        self.refresh()
+
+
+    def refresh(self):
+
+        # reloads the indexes and remaps the columns up to the last published chunk
+        self.chunks = read_records(os.path.join(self.path, "chunks.idx"), CHUNK_RECORD)
+        self.events = read_records(os.path.join(self.path, "events.idx"), EVENT_RECORD)
+        self.rows = int(self.chunks["rows"].sum())
+        self.events = self.events[self.events["row"] < self.rows]
+        self.start_times = self.chunks["start_time"].tolist()
+        self.columns = {}
+
+
+    def column(self, field):
+
+        # the whole column as a read-only memory map (nothing is read until it's sliced)
+        if field not in self.columns:
+            shape = (self.rows, self.num_cylinders) if field in self.cylinder_fields else (self.rows,)
+            if not self.rows:
+                return np.empty(shape, self.dtypes[field])
+            self.columns[field] = np.memmap(os.path.join(self.path, field + ".bin"), self.dtypes[field], "r", 0, shape)
+        return self.columns[field]
+
+
+    def rows_between(self, start, end):
+
+        """
+        Row range [first, last) with start <= time <= end, found through the
+        chunk index and then a search within the chunks at either end
+        """
+
+        times = self.column("time")
+        first_chunk = max(0, bisect.bisect_right(self.start_times, start) - 1)
+        last_chunk = max(0, bisect.bisect_right(self.start_times, end) - 1)
+        if not len(self.chunks):
+            return 0, 0
+
+        def search(chunk, value, side):
+            start_row = int(self.chunks["start_row"][chunk])
+            rows = int(self.chunks["rows"][chunk])
+            return start_row + int(np.searchsorted(times[start_row:start_row + rows], value, side))
+
+        return search(first_chunk, start, "left"), search(last_chunk, end, "right")
+
+
+    def window(self, start, end, fields=None):
+
+        # copies of the given fields (all of them by default) for start <= time <= end
+        first, last = self.rows_between(start, end)
+        return {field: np.array(self.column(field)[first:last]) for field in (fields or self.fields)}
+
+
+    def shifts(self, start=-np.inf, end=np.inf):
+
+        # gear shifts between start and end, with the chunk each one is in
+        events = self.events[(self.events["time"] >= start) & (self.events["time"] <= end)]
+        return [
+            {"time": float(event["time"]), "row": int(event["row"]), "chunk": int(event["row"]) // self.chunk_rows,
+             "from_gear": int(event["from_gear"]), "to_gear": int(event["to_gear"])}
+            for event in events
+        ]
+
+
+def record_run(car, path, duration, dt=None, throttle=1, chunk_rows=65536, **kwargs):
+
+    """
+    Runs car for duration seconds like Car.run(), recording every step into a
+    new archive at path instead of returning arrays; returns the number of rows
+    """
+
+    dt = car.start_run(dt, True)
+    steps = int(duration // dt)
+    throttle = np.broadcast_to(np.asarray(throttle, dtype=float), (steps,)).tolist()
+
+    with ArchiveWriter.for_car(path, car, chunk_rows=chunk_rows, **kwargs) as writer:
+        for i in range(steps):
+            car.update(throttle[i])
+            writer.record(car)
+    return steps
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Record a run into a telemetry archive, or read a time window back")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record")
+    record_parser.add_argument("path")
+    record_parser.add_argument("--duration", type=float, default=60)
+    record_parser.add_argument("--dt", type=float, default=1e-4)
+    record_parser.add_argument("--chunk-rows", type=int, default=65536)
+
+    show_parser = commands.add_parser("show")
+    show_parser.add_argument("path")
+    show_parser.add_argument("--start", type=float, default=0)
+    show_parser.add_argument("--end", type=float, default=np.inf)
+    show_parser.add_argument("--fields", nargs="+", default=None)
+    show_parser.add_argument("--every", type=int, default=1000, help="print every this many rows")
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        from car import Car
+
+        start = time.perf_counter()
+        rows = record_run(Car(), args.path, args.duration, args.dt, chunk_rows=args.chunk_rows)
+        print("{} rows in {:.1f} s".format(rows, time.perf_counter() - start))
+
+    else:
+        reader = ArchiveReader(args.path)
+        window = reader.window(args.start, args.end, args.fields)
+        names = list(window)
+        print(" ".join(names))
+        for i in range(0, len(window[names[0]]), args.every):
+            print(" ".join(str(window[name][i]) for name in names))
+        for shift in reader.shifts(args.start, args.end):
+            print("shift {from_gear}->{to_gear} at {time:.4f} s (row {row}, chunk {chunk})".format(**shift))
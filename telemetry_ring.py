@@ -0,0 +1,265 @@
+import argparse
+import multiprocessing
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+# scalar values at the start of every record, followed by each cylinder's x and current_stroke
+FRAME_FIELDS = ["time", "engine_rpm", "mph", "gear", "torque"]
+
+# header slots (int64)
+CAPACITY, NUM_CYLINDERS, FRAMES_WRITTEN, CLOSED = range(4)
+HEADER_INTS = 8
+HEADER_FLOATS = 8 # [0] is the piston stroke, for drawing
+HEADER_BYTES = 8 * (HEADER_INTS + HEADER_FLOATS)
+
+
+def record_size(num_cylinders):
+    return len(FRAME_FIELDS) + 2 * num_cylinders
+
+
+def buffer_views(buffer, capacity, num_cylinders):
+
+    # NumPy views of the header, the per-slot sequence numbers and the records
+    header = np.ndarray((HEADER_INTS,), np.int64, buffer)
+    header_floats = np.ndarray((HEADER_FLOATS,), np.float64, buffer, 8 * HEADER_INTS)
+    sequence = np.ndarray((capacity,), np.uint64, buffer, HEADER_BYTES)
+    records = np.ndarray((capacity, record_size(num_cylinders)), np.float64, buffer, HEADER_BYTES + 8 * capacity)
+    return header, header_floats, sequence, records
+
+
+class TelemetryWriter:
+
+    """
+    Publishes car telemetry into a shared memory ring buffer of capacity
+    records. Every slot has a sequence number, which works as a per-slot
+    seqlock: it is odd while the slot is being written and 2 * (frame + 1) once
+    frame is complete, so readers can tell finished, torn and overwritten
+    records apart. The writer never waits for readers
+    """
+
+    def __init__(self, num_cylinders, stroke, capacity=1024, name=None) -> None:
+
+        size = HEADER_BYTES + capacity * 8 * (1 + record_size(num_cylinders))
+        self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+        self.name = self.memory.name
+
+        self.header, header_floats, self.sequence, self.records = buffer_views(self.memory.buf, capacity, num_cylinders)
+        self.header[CAPACITY] = capacity
+        self.header[NUM_CYLINDERS] = num_cylinders
+        header_floats[0] = stroke
+
+        self.capacity = capacity
+        self.num_cylinders = num_cylinders
+        self.frames = 0
+
+
+    @classmethod
+    def for_car(cls, car, capacity=1024, name=None):
+        return cls(car.engine.num_cylinders, car.engine.cs.bank.stroke, capacity, name)
+
+
+    def publish(self, car):
+
+        frame = self.frames
+        slot = frame % self.capacity
+        record = self.records[slot]
+        n = self.num_cylinders
+        bank = car.engine.cs.bank
+
+        self.sequence[slot] = 2 * frame + 1
+        record[0] = car.time
+        record[1] = car.engine_rpm
+        record[2] = car.mph
+        record[3] = car.transmission.current_gear
+        record[4] = car.engine.torque
+        record[5:5 + n] = bank.x
+        record[5 + n:] = bank.current_stroke
+        self.sequence[slot] = 2 * frame + 2
+
+        self.frames = frame + 1
+        self.header[FRAMES_WRITTEN] = self.frames
+
+
+    def finish(self):
+
+        # tells readers no more frames are coming
+        self.header[CLOSED] = 1
+
+
+    def close(self):
+
+        # removes the buffer; readers that are still attached keep their mapping
+        self.finish()
+        del self.header, self.sequence, self.records
+        self.memory.close()
+        self.memory.unlink()
+
+
+def attach(name):
+
+    """
+    Opens an existing shared memory block without registering it with this
+    process's resource tracker, which would otherwise remove the writer's
+    buffer when the reader exits (Python < 3.13 has no track=False)
+    """
+
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+
+class TelemetryReader:
+
+    """
+    Reads a TelemetryWriter's ring buffer from any process without locking it.
+    Records are copied into a preallocated frame and kept only if the slot's
+    sequence number was the same, and complete, before and after the copy;
+    frames the writer overwrote first are skipped and counted
+    """
+
+    def __init__(self, name) -> None:
+
+        self.memory = attach(name)
+        header = np.ndarray((HEADER_INTS,), np.int64, self.memory.buf)
+        self.capacity = int(header[CAPACITY])
+        self.num_cylinders = int(header[NUM_CYLINDERS])
+        self.header, header_floats, self.sequence, self.records = buffer_views(self.memory.buf, self.capacity, self.num_cylinders)
+        self.stroke = float(header_floats[0])
+
+        self.frame = np.zeros(record_size(self.num_cylinders))
+        self.next_frame = 0 # next frame new_frames() will return
+        self.skipped = 0
+
+
+    def read(self, frame):
+
+        # copies frame into self.frame; False if it isn't written yet or was overwritten
+        slot = frame % self.capacity
+        expected = 2 * frame + 2
+        if self.sequence[slot] != expected:
+            return False
+        np.copyto(self.frame, self.records[slot])
+        return self.sequence[slot] == expected
+
+
+    def frames_written(self):
+        return int(self.header[FRAMES_WRITTEN])
+
+
+    def closed(self):
+        return bool(self.header[CLOSED])
+
+
+    def latest(self):
+
+        """
+        Returns the newest complete frame (a view of self.frame, valid until the
+        next read) or None if nothing has been written yet
+        """
+
+        written = self.frames_written()
+        for frame in range(written - 1, max(written - self.capacity, 0) - 1, -1):
+            if self.read(frame):
+                return self.frame
+        return None
+
+
+    def new_frames(self):
+
+        """
+        Yields every frame written since the last call, in order, skipping the
+        ones that were overwritten before they could be read; like latest(),
+        each frame is a view of self.frame
+        """
+
+        written = self.frames_written()
+        if self.next_frame < written - self.capacity:
+            self.skipped += written - self.capacity - self.next_frame
+            self.next_frame = written - self.capacity
+
+        while self.next_frame < written:
+            frame = self.next_frame
+            self.next_frame += 1
+            if self.read(frame):
+                yield self.frame
+            else:
+                self.skipped += 1
+
+
+    def pistons(self, frame):
+
+        # the x and current_stroke arrays of a frame
+        n = self.num_cylinders
+        start = len(FRAME_FIELDS)
+        return frame[start:start + n], frame[start + n:]
+
+
+    def close(self):
+        del self.header, self.sequence, self.records, self.frame
+        self.memory.close()
+
+
+def view(name, fps=60, headless=False):
+
+    """
+    Viewer process: draws the newest frame of the ring buffer with an
+    EngineRenderer at fps until the writer closes it or the window is closed
+    """
+
+    from renderer import EngineRenderer
+
+    reader = TelemetryReader(name)
+    renderer = EngineRenderer(None, fps, headless)
+    renderer.layout(reader.num_cylinders, reader.stroke)
+
+    def snapshot():
+        frame = reader.latest()
+        return None if frame is None else reader.pistons(frame)
+
+    while not reader.closed() and not renderer.closed:
+        if not renderer.render_from(snapshot):
+            time.sleep(min(0.002, max(0, renderer.next_frame - time.perf_counter())))
+
+    fps, jitter = renderer.pacing()
+    print("viewer: {} frames, {:.2f} fps, {:.2f} ms jitter".format(renderer.frames, fps, jitter * 1000))
+    renderer.close()
+    reader.close()
+
+
+if __name__ == "__main__":
+
+    # physics in this process, pygame in a viewer process
+    parser = argparse.ArgumentParser(description="Run the car and draw it from a separate viewer process")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--dt", type=float, default=1e-4)
+    parser.add_argument("--every", type=int, default=10, help="publish every this many steps")
+    parser.add_argument("--fps", type=float, default=60)
+    parser.add_argument("--headless", action="store_true")
+    args = parser.parse_args()
+
+    from car import Car
+
+    car = Car(dt=args.dt)
+    writer = TelemetryWriter.for_car(car)
+    viewer = multiprocessing.Process(target=view, args=(writer.name, args.fps, args.headless))
+    viewer.start()
+
+    start = time.perf_counter()
+    for _ in car.stream(args.duration, every=args.every, fields=[]):
+        writer.publish(car)
+    seconds = time.perf_counter() - start
+
+    writer.finish()
+    viewer.join()
+    writer.close()
+    print("physics: {} frames published, {:.1f} simulated seconds per wall second".format(writer.frames, args.duration / seconds))
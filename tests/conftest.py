@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the repository root rather than in a package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def all_args():
+
+    # the repository's parameters.txt, wherever pytest is run from
+    from car import Car
+    return Car.read_parameters(os.path.join(ROOT, "parameters.txt"))
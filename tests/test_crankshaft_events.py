@@ -0,0 +1,44 @@
+import math
+
+import numpy as np
+
+from car import Car
+from crankshaft_cylinder import Crankshaft
+
+
+def spark_times(dt, duration=0.5):
+
+    car = Car(dt=dt, interpolate_events=True)
+    car.engine.cs.event_log = log = []
+    for _ in range(round(duration / dt)):
+        car.update(1)
+    return np.array([time for time, _, stroke in log if stroke == 3])
+
+
+def test_spark_count_and_timing_hold_steady_as_dt_changes():
+
+    reference = spark_times(1e-4)
+    for dt in (2e-4, 4e-4):
+        sparks = spark_times(dt)
+        assert len(sparks) == len(reference)
+
+        # well inside a single step of either run
+        assert np.abs(sparks - reference).max() < 5e-5
+
+
+def test_a_cylinder_fires_more_than_once_in_a_long_step():
+
+    cs = Crankshaft(4, "I", 0.08, 0.09, 10, 1, 6000)
+    cs.interpolate_events = True
+    cs.event_log = log = []
+    cs.set_cylinder_time_step(1e-3)
+    cs.TIME_STEP = 1e-3
+    cs.omega = 2.5 * math.pi / cs.TIME_STEP # two and a half half-turns in one step
+    cs.update(0)
+
+    first = [(time, stroke) for time, cylinder, stroke in log if cylinder == 0]
+    assert [stroke for _, stroke in first] == [3, 0, 1]
+    times = [time for time, _ in first]
+    assert times == sorted(times)
+    assert np.allclose(np.diff(times), cs.TIME_STEP / 2.5)
+    assert len(log) == int(np.sum(cs.check_angles / math.pi))
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from car import Car
+
+
+def test_cycle_cache_runs_live_until_its_table_is_full():
+
+    full = Car(dt=1e-4)
+    cached = Car(dt=1e-4, cycle_cache=True)
+    steps = 0
+    while not cached.engine.cs.cycle_ready:
+        full.update(1)
+        cached.update(1)
+        steps += 1
+        assert cached.engine_rpm == full.engine_rpm
+        assert cached.engine.cs.bank.fuel_used == full.engine.cs.bank.fuel_used
+
+    # one four-stroke cycle of the first cylinder, not the whole run
+    assert 0 < steps < 5000
+
+
+def test_cycle_cache_tracks_the_full_model_after_warm_up():
+
+    full = Car(dt=1e-4)
+    reference = full.run(3)
+    cached = Car(dt=1e-4, cycle_cache=True)
+    trace = cached.run(3)
+
+    assert np.abs(trace["mph"] - reference["mph"]).max() < 0.5
+    assert np.sqrt(np.mean((trace["engine_rpm"] - reference["engine_rpm"])**2)) < 150
+    assert cached.engine.cs.bank.fuel_used == pytest.approx(full.engine.cs.bank.fuel_used, rel=0.01)
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from drive_cycle import run_cycle
+from torque_map import cached_torque_map
+
+
+def test_torque_map_fuel_tracks_the_cylinder_model(all_args, tmp_path):
+
+    # no cylinders inject in map mode, so fuel comes from the operating point instead
+    trace = np.array([[0, 0.2], [2, 0.8], [4, 0.4]])
+    full = run_cycle(trace, 1e-4, all_args)
+    torque_map = cached_torque_map(all_args[0], cache_dir=str(tmp_path))
+    mapped = run_cycle(trace, 1e-3, all_args, torque_map=torque_map)
+
+    assert mapped["fuel_kg"] > 0
+    assert mapped["fuel_kg"] == pytest.approx(full["fuel_kg"], rel=0.05)
+
+    # the map model's speed trace differs a little, so economy is looser
+    assert mapped["mpg"] == pytest.approx(full["mpg"], rel=0.1)
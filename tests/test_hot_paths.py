@@ -0,0 +1,13 @@
+from benchmarks.hot_paths import compare
+
+
+def test_compare_reports_regressions_and_missing_benchmarks():
+
+    baseline = {"results": {"I4/car.update": 1000, "I4/crankshaft.update": 2000, "I4/old": 500}}
+    current = {"results": {"I4/car.update": 850, "I4/crankshaft.update": 1950, "I4/new": 700}}
+
+    regressions, missing, added = compare(baseline, current, 0.1)
+
+    assert regressions == [("I4/car.update", 1000, 850)]
+    assert missing == ["I4/old"]
+    assert added == ["I4/new"]
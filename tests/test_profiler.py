@@ -0,0 +1,27 @@
+from car import Car
+
+
+def test_shift_requests_count_each_shift_once():
+
+    # a shift is asked for on every step until it happens; that is still one request
+    car = Car()
+    profiler = car.enable_profiling()
+    car.run(3, 1e-4)
+
+    assert profiler.events["upshifts"] == 2
+    assert profiler.events["shift_requests"] == profiler.events["upshifts"] + profiler.events["downshifts"]
+
+
+def test_cycle_cache_counts_every_cylinders_strokes():
+
+    # the cached cylinders have no check angles of their own but still change stroke
+    counts = []
+    for car in (Car(dt=1e-4), Car(dt=1e-4, cycle_cache=True)):
+        profiler = car.enable_profiling()
+        car.run(2)
+        counts.append({name: profiler.events[name] for name in ("stroke_transitions", "sparks", "injections", "exhausts")})
+
+    full, cached = counts
+    assert full["sparks"] > 0
+    for name, count in full.items():
+        assert abs(cached[name] - count) <= 0.01 * count
@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip("pygame")
+
+from car import Car
+from renderer import EngineRenderer
+
+
+@pytest.fixture
+def headless(monkeypatch):
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+
+
+def test_frames_follow_simulated_time(headless):
+
+    # paced by the simulated clock, a run of fixed length always gets the same frames, evenly spaced
+    car = Car(dt=1e-4)
+    fps = 60
+    duration = 1
+    renderer = EngineRenderer(car.engine, fps, headless=True, clock=lambda: car.time)
+    try:
+        while car.time < duration:
+            car.update()
+            renderer.render(car.engine)
+    finally:
+        renderer.close()
+
+    assert renderer.frames == duration * fps + 1
+    mean_fps, jitter = renderer.pacing()
+    assert mean_fps == pytest.approx(fps, rel=1e-3)
+    assert jitter <= car.TIME_STEP
+
+
+def test_frames_keep_wall_clock_rate(headless):
+
+    # physics as fast as it goes, frames only at the fixed rate; a fake wall clock
+    # that each physics step advances by its cost keeps the check deterministic
+    car = Car(dt=1e-4)
+    fps = 30
+    seconds = 1
+    step_cost = 5e-5 # wall-clock seconds per 1e-4 s step, twice real time
+    wall_time = 0.0
+    renderer = EngineRenderer(car.engine, fps, headless=True, clock=lambda: wall_time)
+    try:
+        while wall_time < seconds:
+            car.update()
+            wall_time += step_cost
+            renderer.render(car.engine)
+    finally:
+        renderer.close()
+
+    # frames follow the wall clock, not the simulated time, which ran further
+    assert car.time > 1.5 * wall_time
+    assert abs(renderer.frames - seconds * fps) <= 1
+    mean_fps, jitter = renderer.pacing()
+    assert mean_fps == pytest.approx(fps, rel=0.01)
+    assert jitter <= step_cost
@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+
+from car import Car
+from result_cache import ResultCache
+from torque_map import TorqueMap
+
+
+def test_keys_accept_numpy_values_and_torque_maps(tmp_path):
+
+    cache = ResultCache(str(tmp_path))
+    all_args = Car.read_parameters("parameters.txt")
+    torque_map = TorqueMap([1000, 2000], [0, 1], [[0, 100], [0, 120]])
+
+    key = cache.key("run", all_args, 1e-4, 1, torque_map=torque_map)
+    assert key == cache.key("run", all_args, np.float64(1e-4), 1, torque_map=TorqueMap([1000, 2000], [0, 1], np.array([[0, 100], [0, 120]])))
+    assert key != cache.key("run", all_args, 1e-4, 1, torque_map=TorqueMap([1000, 2000], [0, 1], [[0, 100], [0, 130]]))
+
+    numpy_args = [list(group) for group in all_args]
+    numpy_args[1][0] = np.float64(all_args[1][0])
+    numpy_args[2][1] = np.array(all_args[2][1])
+    assert cache.key("run", numpy_args, 1e-4, 1) == cache.key("run", all_args, 1e-4, 1)
+
+
+def test_a_corrupt_entry_is_a_miss_and_is_evicted(tmp_path):
+
+    cache = ResultCache(str(tmp_path))
+    all_args = Car.read_parameters("parameters.txt")
+    expected = cache.summary(all_args, 0.05, 1e-4)
+
+    key = cache.key("run", all_args, 1e-4, 0.05)
+    with open(cache.path(key), "r+b") as file:
+        file.truncate(os.path.getsize(cache.path(key)) // 2)
+
+    assert cache.load(key) is None
+    assert not os.path.exists(cache.path(key))
+
+    # the summary is worked out again and stored afresh
+    summary = cache.summary(all_args, 0.05, 1e-4)
+    assert list(summary) == list(expected)
+    assert np.allclose(list(summary.values()), list(expected.values()), equal_nan=True)
+    assert cache.load(key) is not None
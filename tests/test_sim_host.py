@@ -0,0 +1,31 @@
+import asyncio
+import json
+
+import pytest
+
+from sim_host import SimulationHost
+
+
+def test_adding_an_existing_car_is_an_error():
+
+    async def scenario():
+        host = SimulationHost(use_torque_map=False)
+        first = host.add_car(0)
+        with pytest.raises(ValueError):
+            host.add_car(0)
+        assert host.cars[0] is first and len(host.tasks) == 1
+        await host.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_replies_to_a_client_whose_queue_is_full_are_dropped():
+
+    async def scenario():
+        host = SimulationHost(use_torque_map=False)
+        queue = asyncio.Queue(maxsize=1)
+        host.offer(queue, json.dumps({"error": "first"}) + "\n")
+        host.offer(queue, json.dumps({"error": "second"}) + "\n")
+        assert queue.qsize() == 1 and host.dropped_messages == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,27 @@
+import numpy as np
+
+from sweep import run_key, sweep
+
+
+def test_run_key_treats_equal_settings_alike(all_args):
+
+    key = run_key(all_args, {}, 2, 1e-3, 1)
+
+    assert run_key(all_args, {}, np.float64(2), np.float64(1e-3), np.float64(1)) == key
+    assert run_key(all_args, {}, 2, 1e-3, 0.5) != key
+
+    throttle = np.linspace(0, 1, 2000)
+    assert run_key(all_args, {}, 2, 1e-3, throttle) == run_key(all_args, {}, 2, 1e-3, throttle.copy())
+    assert run_key(all_args, {}, 2, 1e-3, throttle) != run_key(all_args, {}, 2, 1e-3, throttle[::-1])
+
+
+def test_sweep_takes_a_throttle_trace(all_args, tmp_path):
+
+    # one value per step, as many steps as Car.run() takes
+    throttle = np.linspace(0, 1, int(0.5 // 1e-3))
+    summary = sweep([{}], str(tmp_path), 0.5, 1e-3, throttle, all_args, workers=1, progress=False)
+    assert len(summary["top_mph"]) == 1
+
+    # a resumed sweep finds the run by its key instead of repeating it
+    run, = (tmp_path / "runs").iterdir()
+    assert run.name == run_key(all_args, {}, 0.5, 1e-3, throttle) + ".npz"
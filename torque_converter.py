@@ -1,9 +1,4 @@
-import sys
-import numpy as np
-import matplotlib.pyplot as plt
-import time
 import math
-import copy
 
 
 class TorqueConverter:
@@ -0,0 +1,141 @@
+import bisect
+import hashlib
+import math
+import os
+
+import numpy as np
+
+from engine import Engine
+
+
+# bump when the characterization changes so old cached maps are not reused
+MAP_VERSION = 1
+
+DEFAULT_RPM_POINTS = [250, 500, 1000, 1500, 2000, 2500, 3000, 3500, 4000, 4500, 5000, 5500, 6000, 6500, 7000, 7500, 8000, 9000]
+DEFAULT_THROTTLE_POINTS = [0, 0.2, 0.4, 0.6, 0.8, 1]
+
+
+class TorqueMap:
+
+    """
+    Mean engine torque (N*m) on a grid of rpm and throttle values; torque[i][j]
+    is the torque at rpm_points[i] and throttle_points[j]
+    """
+
+    def __init__(self, rpm_points, throttle_points, torque) -> None:
+
+        self.rpm_points = [float(rpm) for rpm in rpm_points]
+        self.throttle_points = [float(throttle) for throttle in throttle_points]
+        self.torque = np.asarray(torque, dtype=float)
+
+        # plain lists are faster than NumPy for single lookups
+        self.table = self.torque.tolist()
+
+
+    def torque_at(self, rpm, throttle):
+
+        """
+        Bilinear interpolation of the table; values outside the grid are clamped
+        to its edges
+        """
+
+        i, rpm_fraction = self.locate(self.rpm_points, rpm)
+        j, throttle_fraction = self.locate(self.throttle_points, throttle)
+
+        low = self.table[i]
+        high = self.table[i + 1]
+        low_torque = low[j] + (high[j] - low[j]) * rpm_fraction
+        high_torque = low[j + 1] + (high[j + 1] - low[j + 1]) * rpm_fraction
+        return low_torque + (high_torque - low_torque) * throttle_fraction
+
+
+    def hp_at(self, rpm, throttle):
+        return self.torque_at(rpm, throttle) * rpm * 2 * math.pi / 60 / 745.7
+
+
+    @staticmethod
+    def locate(points, value):
+
+        # index of the grid cell holding value and how far along it value is
+        if value <= points[0]:
+            return 0, 0.0
+        if value >= points[-1]:
+            return len(points) - 2, 1.0
+        i = bisect.bisect_right(points, value) - 1
+        return i, (value - points[i]) / (points[i + 1] - points[i])
+
+
+    def save(self, path):
+        np.savez(path, rpm_points=self.rpm_points, throttle_points=self.throttle_points, torque=self.torque)
+
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["rpm_points"], data["throttle_points"], data["torque"])
+
+
+def steady_state_torque(engine_args, rpm, throttle, crank_step=math.radians(2), warmup_cycles=1, cycles=2):
+
+    """
+    Holds a fresh engine at a constant rpm, like a dynamometer, and returns its
+    mean crankshaft torque over the given number of four-stroke cycles after
+    warming up; the time step is chosen so the crank turns crank_step per step
+    """
+
+    engine = Engine(*engine_args)
+    omega = rpm * 2 * math.pi / 60
+    dt = crank_step / omega
+    engine.cs.set_cylinder_time_step(dt)
+    engine.cs.TIME_STEP = dt
+
+    steps_per_cycle = round(4 * math.pi / crank_step)
+    total = 0
+    for step in range((warmup_cycles + cycles) * steps_per_cycle):
+        engine.cs.omega = omega
+        engine.update(throttle, 0)
+        if step >= warmup_cycles * steps_per_cycle:
+            total += engine.torque
+
+    return total / (cycles * steps_per_cycle)
+
+
+def characterize(engine_args, rpm_points=DEFAULT_RPM_POINTS, throttle_points=DEFAULT_THROTTLE_POINTS, crank_step=math.radians(2)):
+
+    """
+    Builds a TorqueMap by running the detailed crankshaft and cylinder model at
+    steady state at every grid point
+    """
+
+    torque = [
+        [steady_state_torque(engine_args, rpm, throttle, crank_step) for throttle in throttle_points]
+        for rpm in rpm_points
+    ]
+    return TorqueMap(rpm_points, throttle_points, torque)
+
+
+def map_key(engine_args, rpm_points, throttle_points, crank_step):
+    description = repr([MAP_VERSION, list(engine_args), list(rpm_points), list(throttle_points), crank_step])
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def cached_torque_map(engine_args, cache_dir="torque_maps", rpm_points=DEFAULT_RPM_POINTS, throttle_points=DEFAULT_THROTTLE_POINTS, crank_step=math.radians(2)):
+
+    """
+    Returns the TorqueMap for engine_args, characterizing the engine only if no
+    map for the same engine args and grid is cached in cache_dir
+    """
+
+    path = os.path.join(cache_dir, map_key(engine_args, rpm_points, throttle_points, crank_step) + ".npz")
+    if os.path.exists(path):
+        return TorqueMap.load(path)
+
+    torque_map = characterize(engine_args, rpm_points, throttle_points, crank_step)
+
+    # write to a temporary file first so a half-written map is never loaded
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary = path + ".tmp.npz"
+    torque_map.save(temporary)
+    os.replace(temporary, path)
+
+    return torque_map
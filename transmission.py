@@ -1,20 +1,177 @@
-import sys
-import numpy as np
-import matplotlib.pyplot as plt
-import time
-import math
-import copy
+import bisect
+
+from config import ConfigError
+
+
+# (engine rpm, mph) pairs that trigger a shift; upshift points are scaled by throttle
+UPSHIFT_POINTS = [
+    (4000, 15),
+    (7000, 25),
+    (6500, 40),
+    (7000, 70),
+    (8000, 85),
+]
+
+DOWNSHIFT_POINTS = [
+    (1000, 10),
+    (1500, 20),
+    (3000, 30),
+    (3000, 45),
+    (3000, 60),
+]
+
+
+class ShiftMap:
+
+    """
+    Shift schedule as lookup tables indexed by gear and throttle. upshift[g][i]
+    holds the (engine rpm, mph) pairs for gear g + 1 at throttle_points[i]; the
+    transmission upshifts when both values are above any one pair, and
+    downshifts when both are below any of the downshift pairs. Thresholds
+    between throttle points are interpolated linearly, so every throttle point
+    of a gear needs the same number of pairs
+    """
+
+    def __init__(self, throttle_points, upshift, downshift) -> None:
+
+        self.throttle_points = [float(throttle) for throttle in throttle_points]
+        self.upshift = upshift
+        self.downshift = downshift
+
+
+    @classmethod
+    def legacy(cls, number_of_gears):
+
+        """
+        The original schedule: from gear g, any of UPSHIFT_POINTS g onward scaled
+        by throttle triggers an upshift, and DOWNSHIFT_POINTS only apply in top
+        gear
+        """
+
+        upshift = []
+        downshift = []
+        for gear in range(1, number_of_gears + 1):
+            points = [(float(rpm), float(speed)) for rpm, speed in UPSHIFT_POINTS[gear - 1:]] if gear < number_of_gears else []
+            upshift.append([[(0.0, 0.0)] * len(points), points])
+            points = [(float(rpm), float(speed)) for rpm, speed in DOWNSHIFT_POINTS] if gear == number_of_gears >= 2 else []
+            downshift.append([points, points])
+        return cls([0, 1], upshift, downshift)
+
+
+    @classmethod
+    def load(cls, file_name):
+
+        """
+        Reads a shift map file with one threshold per line:
+            up|down  gear  throttle  rpm  mph
+        Blank lines and lines starting with # are ignored. Each gear lists the
+        same number of thresholds at every throttle point it uses
+        """
+
+        entries = {}
+        throttle_points = set()
+        with open(file_name) as file:
+            for line_number, line in enumerate(file, 1):
+                line = line.strip()
+                if not line or line[0] == '#':
+                    continue
+                try:
+                    kind, gear, throttle, rpm, speed = line.split()
+                    gear, throttle, rpm, speed = int(gear), float(throttle), float(rpm), float(speed)
+                    if kind not in ("up", "down") or gear < 1:
+                        raise ValueError
+                except ValueError:
+                    raise ConfigError("{}:{}: expected 'up|down gear throttle rpm mph'".format(file_name, line_number)) from None
+                entries.setdefault((kind, gear), {}).setdefault(throttle, []).append((rpm, speed))
+                throttle_points.add(throttle)
+
+        # gears may use different throttle points; each is resampled onto all of them
+        throttle_points = sorted(throttle_points)
+        number_of_gears = max([gear for kind, gear in entries], default=0)
+        tables = {"up": [], "down": []}
+        for kind, table in tables.items():
+            for gear in range(1, number_of_gears + 1):
+                by_throttle = entries.get((kind, gear), {})
+                if len(set(map(len, by_throttle.values()))) > 1:
+                    raise ConfigError("{}: {}shift gear {} needs the same number of thresholds at every throttle point".format(file_name, kind, gear))
+                if not by_throttle:
+                    table.append([[] for throttle in throttle_points])
+                    continue
+                gear_map = cls(sorted(by_throttle), [[by_throttle[throttle] for throttle in sorted(by_throttle)]], [])
+                table.append([gear_map.thresholds(throttle, 1)[0][0] for throttle in throttle_points])
+
+        return cls(throttle_points, tables["up"], tables["down"])
+
+
+    def locate(self, throttle):
+
+        # index of the throttle cell holding throttle and how far along it throttle is
+        points = self.throttle_points
+        if len(points) < 2 or throttle <= points[0]:
+            return 0, 0.0
+        if throttle >= points[-1]:
+            return len(points) - 2, 1.0
+        i = bisect.bisect_right(points, throttle) - 1
+        return i, (throttle - points[i]) / (points[i + 1] - points[i])
+
+
+    def thresholds(self, throttle, number_of_gears):
+
+        """
+        Returns the upshift and downshift tables at throttle: one list of (rpm,
+        mph) pairs per gear, for gears 1 to number_of_gears
+        """
+
+        i, fraction = self.locate(throttle)
+
+        def interpolate(table):
+            rows = []
+            for gear in range(number_of_gears):
+                if gear >= len(table) or not table[gear]:
+                    rows.append([])
+                    continue
+                low = table[gear][i]
+                high = table[gear][min(i + 1, len(table[gear]) - 1)]
+                rows.append([
+                    (low_rpm + (high_rpm - low_rpm) * fraction, low_speed + (high_speed - low_speed) * fraction)
+                    for (low_rpm, low_speed), (high_rpm, high_speed) in zip(low, high)
+                ])
+            return rows
+
+        return interpolate(self.upshift), interpolate(self.downshift)
+
+
+# the built-in schedule depends only on the number of gears, so transmissions share one
+LEGACY_MAPS = {}
+
+
+def legacy_shift_map(number_of_gears):
+    if number_of_gears not in LEGACY_MAPS:
+        LEGACY_MAPS[number_of_gears] = ShiftMap.legacy(number_of_gears)
+    return LEGACY_MAPS[number_of_gears]
 
 
 class Transmission:
 
-    def __init__(self, number_of_gears, ratio_list, shift_time) -> None:
+    def __init__(self, number_of_gears, ratio_list, shift_time, shift_map="") -> None:
         
         self.TIME_STEP = 0
         
         self.number_of_gears = number_of_gears
         self.ratio_list = ratio_list
         self.shift_time = shift_time
+
+        # a ShiftMap, the name of a shift map file, or blank for the original schedule
+        if not shift_map:
+            shift_map = legacy_shift_map(number_of_gears)
+        elif isinstance(shift_map, str):
+            shift_map = ShiftMap.load(shift_map)
+        self.shift_map = shift_map
+
+        # thresholds at the last throttle seen; only looked up again when it changes
+        self.map_throttle = None
+        self.upshift_table = None
+        self.downshift_table = None
         
         self.current_gear = 1
         self.gear_ratio = self.ratio_list[self.current_gear - 1]
@@ -24,22 +181,27 @@ class Transmission:
         self.input_omega = 0
         self.output_omega = 0
 
+        self.shift_delay_step = 0
         self.shift_delay = self.shift_delay_gen()
         self.shifting = False
         self.just_shifted = False
         self.save_where_shift = None
 
-    def shift_delay_gen(self):
+    def shift_delay_gen(self, start=0):
 
         """
         Generator function that returns False during shift delay and
-        True when shift is complete
+        True when shift is complete; shift_delay_step counts the False
+        values returned so far, and start resumes partway through a delay
         """
 
         number_of_steps = int(self.shift_time // self.TIME_STEP)
+        self.shift_delay_step = start
         while True:
-            for _ in range(number_of_steps):
+            while self.shift_delay_step < number_of_steps:
+                self.shift_delay_step += 1
                 yield False
+            self.shift_delay_step = 0
             yield True
     
     
@@ -56,35 +218,22 @@ class Transmission:
     def shifting_logic (self, throttle, engine_rpm, vehicle_speed):
 
         """
-        Defines conditions for shifting gears; returns True for upshift, 
-        False for downshift, and None for no shift
+        Defines conditions for shifting gears from the shift map; returns True
+        for upshift, False for downshift, and None for no shift
         """
-        
-        upshift_points = [
-            (4000 * throttle, 15 * throttle),   
-            (7000 * throttle, 25 * throttle),  
-            (6500 * throttle, 40 * throttle),  
-            (7000 * throttle, 70 * throttle),
-            (8000 * throttle, 85 * throttle),
-        ]
-        
-        downshift_points = [
-            (1000, 10),   
-            (1500, 20),  
-            (3000, 30),  
-            (3000, 45), 
-            (3000, 60),
-        ]
+
+        if throttle != self.map_throttle:
+            self.upshift_table, self.downshift_table = self.shift_map.thresholds(throttle, self.number_of_gears)
+            self.map_throttle = throttle
 
         if self.current_gear <= self.number_of_gears - 1:
-            for check_rpm, check_speed in upshift_points[self.current_gear - 1:]:
+            for check_rpm, check_speed in self.upshift_table[self.current_gear - 1]:
                 if engine_rpm > check_rpm and vehicle_speed > check_speed:
                     return True
         
-        elif self.current_gear >= 2:
-            for check_rpm, check_speed in downshift_points:
+        if self.current_gear >= 2:
+            for check_rpm, check_speed in self.downshift_table[self.current_gear - 1]:
                 if engine_rpm < check_rpm and vehicle_speed < check_speed:
-                    print("downshift")
                     return False
         
         return None
@@ -1,12 +1,3 @@
-
-import sys
-import numpy as np
-import matplotlib.pyplot as plt
-import time
-import math
-import copy
-
-
 class Wheels:
 
     def __init__(self, final_drive_ratio=3, drag_coef=0.2, cross_sectional_area=2, mass_per_wheel=27, radius=0.24) -> None: